@@ -0,0 +1,161 @@
+# batch.py
+"""
+无界面的批量处理入口：把整个目录的录音按若干温度批量渲染到输出目录。
+
+    python batch.py 录音目录 输出目录 -t 0.7 1.5 -j 8 --format flac
+
+- 只导入 utils / streaming 里的处理函数，不加载 Streamlit 与绘图库
+- 每个 (文件, 温度) 是一个独立任务，分发到进程池并行执行，吞吐量随核数增长
+- 每个任务走流式管线，峰值内存只取决于块大小，与录音时长无关
+- 输出先写临时文件再原子改名，已存在的输出直接跳过，中断后重跑即可续做
+- 输出目录下的 manifest.json 随每个任务完成实时更新，记录来源、指纹与耗时
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import soundfile as sf
+
+import cache
+import streaming
+import utils
+import worker
+
+MANIFEST_NAME = "manifest.json"
+# 默认按这些扩展名收集输入文件
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".flac", ".ogg")
+OUTPUT_FORMATS = ("wav", "flac", "npy")
+
+
+def _output_path(output_dir: str, rel_path: str, temperature: float, fmt: str) -> str:
+    """录音目录里的相对路径 + 温度 → 输出路径，例如 a/b.wav @0.7 → 输出目录/a/b__t0.70.flac"""
+    stem = os.path.splitext(rel_path)[0]
+    return os.path.join(output_dir, f"{stem}__t{temperature:.2f}.{fmt}")
+
+
+def _render_job(source_path: str, out_path: str, temperature: float, block_size: int) -> dict:
+    """
+    在 worker 进程里执行的单个任务：流式处理一个文件的一个温度档位。
+    必须是模块级函数，才能被进程池序列化后分发。
+    """
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    base, ext = os.path.splitext(out_path)
+    # 保留扩展名，soundfile 才能据此推断输出格式
+    tmp_path = f"{base}.{os.getpid()}.partial{ext}"
+
+    try:
+        sr = sf.info(source_path).samplerate
+        source = source_path
+    except sf.SoundFileError:
+        # soundfile 不认识的格式：整段解码后再走同一条流式管线
+        with open(source_path, "rb") as f:
+            source, sr = utils.decode_audio_bytes(f.read())
+
+    try:
+        streaming.process_file_streaming(source, tmp_path, temperature, sr=sr, block_size=block_size)
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    if out_path.endswith(".npy"):
+        n_frames = len(np.load(out_path, mmap_mode="r"))
+    else:
+        n_frames = sf.info(out_path).frames
+
+    return {
+        "source": source_path,
+        "source_hash": cache.file_content_hash(source_path),
+        "temperature": temperature,
+        "sr": sr,
+        "duration": round(n_frames / sr, 3),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def collect_sources(input_dir: str, extensions=AUDIO_EXTENSIONS) -> list:
+    """递归收集输入目录下的音频文件，返回相对路径列表"""
+    sources = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(files):
+            if name.lower().endswith(extensions) and not name.startswith("."):
+                sources.append(os.path.relpath(os.path.join(root, name), input_dir))
+    return sources
+
+
+def _load_manifest(manifest_path: str) -> dict:
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"outputs": {}}
+
+
+def _save_manifest(manifest_path: str, manifest: dict):
+    """先写临时文件再原子替换，中途被杀也不会留下半个清单"""
+    cache.atomic_write(manifest_path, json.dumps(manifest, ensure_ascii=False, indent=1).encode("utf-8"))
+
+
+def run_batch(input_dir: str, output_dir: str, temperatures, workers: int = None, fmt: str = "flac",
+              block_size: int = 65536, force: bool = False) -> int:
+    """
+    批量处理主流程。
+
+    Returns:
+        失败的任务数 (0 表示全部成功)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = _load_manifest(manifest_path)
+    temperatures = sorted({cache.quantize_temperature(t) for t in temperatures})
+
+    # 1. 展开 (文件 × 温度) 任务，跳过输出已存在的部分；任务名取输出的相对路径
+    jobs = []
+    skipped = 0
+    for rel_path in collect_sources(input_dir):
+        source_path = os.path.join(input_dir, rel_path)
+        for temperature in temperatures:
+            out_path = _output_path(output_dir, rel_path, temperature, fmt)
+            if os.path.exists(out_path) and not force:
+                skipped += 1
+                continue
+            jobs.append((os.path.getsize(source_path), os.path.relpath(out_path, output_dir),
+                         (source_path, out_path, temperature, block_size)))
+    print(f"{len(jobs)} 个任务待处理，{skipped} 个输出已存在被跳过")
+
+    # 2. 分发到进程池，每完成一个就更新一次清单
+    def _record(rel_out, record):
+        record["source"] = os.path.relpath(record["source"], input_dir)
+        manifest.setdefault("outputs", {})[rel_out] = record
+        _save_manifest(manifest_path, manifest)
+        return f"{rel_out} ({record['seconds']:.1f} s)"
+
+    return worker.run_process_jobs(_render_job, jobs, _record, workers=workers)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="言冰 (Voiceice) 批量温度渲染")
+    parser.add_argument("input_dir", help="录音所在目录 (递归扫描)")
+    parser.add_argument("output_dir", help="输出目录，清单写在其中的 manifest.json")
+    parser.add_argument("-t", "--temperatures", type=float, nargs="+", default=[0.7, 1.5],
+                        help="要渲染的温度档位 (默认: 0.7 1.5)")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="并行进程数 (默认: CPU 核数)")
+    parser.add_argument("-f", "--format", choices=OUTPUT_FORMATS, default="flac",
+                        help="输出格式 (默认: flac；npy 为 float32 内存映射数组)")
+    parser.add_argument("--block-size", type=int, default=65536, help="流式处理的块大小 (采样点)")
+    parser.add_argument("--force", action="store_true", help="忽略已存在的输出，全部重新渲染")
+    args = parser.parse_args(argv)
+
+    failures = run_batch(args.input_dir, args.output_dir, args.temperatures, workers=args.workers,
+                         fmt=args.format, block_size=args.block_size, force=args.force)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
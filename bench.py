@@ -0,0 +1,372 @@
+# bench.py
+"""
+DSP / 绘图 / 编码热点路径的基准测试。
+
+    python bench.py --quick                          # 快速冒烟 (1 s、10 s，22.05 kHz)
+    python bench.py -o baseline.json                 # 完整扫描并保存结果
+    python bench.py --compare baseline.json          # 重新测量并与基线对比，有回归时返回码为 1
+    python bench.py --compare baseline.json --results new.json   # 只对比两份已有结果
+    python bench.py --startup -o startup.json        # 冷启动：导入、预热与第一次处理的耗时
+
+- 全部使用可复现的合成信号 (固定随机种子)，不需要联网或下载样本
+- 扫描 时长 × 采样率 × 温度，温度覆盖 <1.0 (低通)、==1.0 (直通)、>1.0 (饱和) 三条分支
+- 每个阶段记录墙钟时间 (多次取最小值与平均值) 与 tracemalloc 统计的峰值内存
+- 超过 --max-offline-seconds 的长录音与应用本身一样改走流式管线，
+  合成信号写成内存映射文件，整段处理的阶段记为 skipped
+- --startup 每次新开一个解释器测冷启动，结果格式相同，同样可以用 --compare 防止回归
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import streaming
+import utils
+
+DEFAULT_DURATIONS = [1, 10, 60, 600, 3600]
+DEFAULT_RATES = [16000, 22050, 44100, 48000]
+DEFAULT_TEMPERATURES = [0.7, 1.0, 1.5]
+# 整块处理的阶段 (长录音在应用里不会走这些路径)
+OFFLINE_STAGES = ("speed_and_pitch", "stretch_and_shift", "lowpass", "saturation")
+STAGES = OFFLINE_STAGES + ("streaming", "waveform_pyramid", "draw_waveform",
+                           "spectrogram_pyramid", "draw_spectrogram", "encode_flac", "encode_ogg")
+# 冷启动阶段 (--startup)；带 _warm 后缀的是先预热再测的第一次处理
+STARTUP_STAGES = ("startup_import", "startup_import_ui", "startup_warm_up",
+                  "startup_first_render", "startup_first_features",
+                  "startup_first_render_warm", "startup_first_features_warm")
+
+
+# ------------------------------------------------------------
+# 合成信号
+# ------------------------------------------------------------
+def _synthetic_block(start: int, n: int, sr: int, seed: int) -> np.ndarray:
+    """
+    类语音的合成信号：基频缓慢起伏的谐波 + 约 4 Hz 的音节包络 + 少量噪声。
+    相位用解析式计算，任意分块生成的结果都能无缝拼接。
+    """
+    t = (start + np.arange(n)) / sr
+    # f0(t) = 140 + 30·sin(2π·0.3t) 的积分，即瞬时相位 / 2π
+    cycles = 140.0 * t - 30.0 / (2 * np.pi * 0.3) * np.cos(2 * np.pi * 0.3 * t)
+    voiced = sum(np.sin(2 * np.pi * k * cycles) / k for k in range(1, 9))
+    envelope = np.sin(np.pi * 4.0 * t) ** 2
+    # 噪声按块号单独播种，保证同一位置每次生成的值都一样
+    noise = np.random.default_rng([seed, start]).standard_normal(n) * 0.02
+    return (0.25 * envelope * voiced + noise).astype(np.float32)
+
+
+def synthetic_signal(duration: float, sr: int, seed: int = 0, out_path: str = None,
+                     block_size: int = 1 << 20) -> np.ndarray:
+    """生成 duration 秒的合成信号；给出 out_path 时写成 .npy 并以内存映射返回"""
+    n = int(round(duration * sr))
+    if out_path is None:
+        return _synthetic_block(0, n, sr, seed)
+    out = np.lib.format.open_memmap(out_path, mode="w+", dtype=np.float32, shape=(n,))
+    for start in range(0, n, block_size):
+        out[start:start + block_size] = _synthetic_block(start, min(block_size, n - start), sr, seed)
+    out.flush()
+    del out
+    return np.load(out_path, mmap_mode="r")
+
+
+# ------------------------------------------------------------
+# 测量
+# ------------------------------------------------------------
+def measure(fn, repeat: int = 3, memory: bool = True) -> tuple:
+    """
+    先跑 repeat 次测墙钟时间 (不开 tracemalloc，避免它拖慢计时)，
+    再单独跑一次统计峰值内存。
+
+    Returns:
+        (第一次运行的返回值, {seconds, seconds_mean, peak_mb})
+    """
+    result = None
+    times = []
+    for i in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        value = fn()
+        times.append(time.perf_counter() - start)
+        if i == 0:
+            result = value
+        del value
+
+    peak_mb = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        peak_mb = round(peak / 2 ** 20, 3)
+
+    return result, {
+        "seconds": round(min(times), 6),
+        "seconds_mean": round(sum(times) / len(times), 6),
+        "peak_mb": peak_mb,
+    }
+
+
+def _stage_functions(y, sr, temperature, work_dir, processed):
+    """每个阶段对应一个无参函数；processed 是一个单元素列表，用来把处理结果传给绘图与编码阶段"""
+    real_rate, real_pitch = utils._temperature_params(temperature)
+    cutoff, _, drive = utils._tone_params(temperature)
+    stream_path = os.path.join(work_dir, f"stream_{sr}_{temperature}.npy")
+
+    def _streaming():
+        streaming.process_file_streaming(y, stream_path, temperature, sr=sr)
+        return np.load(stream_path, mmap_mode="r")
+
+    return {
+        "speed_and_pitch": lambda: utils.process_audio_speed_and_pitch(y, temperature, sr),
+        # 直通 (==1.0) 时没有变速变调，滤波 / 饱和也只在各自的分支里出现
+        "stretch_and_shift": (lambda: utils.stretch_and_shift(y, sr, real_rate, real_pitch))
+        if temperature != 1.0 else None,
+        "lowpass": (lambda: utils.apply_lowpass_filter(y, sr, cutoff)) if cutoff is not None else None,
+        "saturation": (lambda: utils.apply_saturation(y, drive)) if drive is not None else None,
+        "streaming": _streaming,
+        "waveform_pyramid": lambda: utils.WaveformPyramid(processed[0], sr),
+        "draw_waveform": lambda: utils.draw_waveform_plotly(utils.WaveformPyramid(processed[0], sr), "bench", "#40E0D0"),
+        "spectrogram_pyramid": lambda: utils.SpectrogramPyramid(processed[0], sr),
+        "draw_spectrogram": lambda: utils.draw_spectrogram(utils.SpectrogramPyramid(processed[0], sr), "bench"),
+        "encode_flac": lambda: utils.encode_playback(processed[0], sr, "FLAC"),
+        "encode_ogg": lambda: utils.encode_playback(processed[0], sr, "OGG"),
+    }
+
+
+def run_case(duration: float, sr: int, temperature: float, y, work_dir: str, stages, repeat: int,
+             memory: bool, max_offline_seconds: float) -> list:
+    """测量一个 (时长, 采样率, 温度) 组合下的全部阶段"""
+    processed = [y]
+    functions = _stage_functions(y, sr, temperature, work_dir, processed)
+    long_audio = duration > max_offline_seconds
+    # 长录音每个阶段都要跑很久，只测一次
+    case_repeat = repeat if duration <= 60 else 1
+
+    rows = []
+    for stage in STAGES:
+        if stage not in stages:
+            continue
+        row = {"stage": stage, "duration": duration, "sr": sr, "temperature": temperature}
+        fn = functions[stage]
+        if fn is None:
+            row["status"] = "n/a"
+        elif long_audio and stage in OFFLINE_STAGES:
+            row["status"] = "skipped"
+        else:
+            try:
+                result, stats = measure(fn, case_repeat, memory)
+                row.update(stats, status="ok")
+                # 绘图与编码阶段使用与应用一致的输入：整块处理结果，长录音则是流式结果
+                if stage == "speed_and_pitch" or (stage == "streaming" and long_audio):
+                    processed[0] = result
+            except Exception as e:
+                row.update(status="error", error=repr(e))
+        rows.append(row)
+        print(_format_row(row), flush=True)
+    return rows
+
+
+def _format_row(row: dict) -> str:
+    head = f"{row['stage']:<28} {row['duration']:>7g} s {row['sr']:>6} Hz  t={row['temperature']:<4g}"
+    if row["status"] != "ok":
+        return f"{head}  {row['status']}"
+    peak = f"{row['peak_mb']:>9.1f} MB" if row["peak_mb"] is not None else ""
+    return f"{head}  {row['seconds'] * 1000:>10.1f} ms {peak}"
+
+
+def run_suite(durations, rates, temperatures, stages=STAGES, repeat: int = 3, memory: bool = True,
+              max_offline_seconds: float = 600, seed: int = 0) -> dict:
+    results = []
+    with tempfile.TemporaryDirectory(prefix="voiceice_bench_") as work_dir:
+        for duration in durations:
+            for sr in rates:
+                # 长录音的合成信号写成内存映射文件，与应用里的解码缓存一致
+                source_path = os.path.join(work_dir, f"source_{sr}.npy") if duration > max_offline_seconds else None
+                y = synthetic_signal(duration, sr, seed, source_path)
+                for temperature in temperatures:
+                    results.extend(run_case(duration, sr, temperature, y, work_dir, stages, repeat,
+                                            memory, max_offline_seconds))
+                del y
+
+    return {"meta": _meta(repeat, seed), "results": results}
+
+
+def _meta(repeat: int, seed: int) -> dict:
+    import librosa
+    import scipy
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "librosa": librosa.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeat": repeat,
+        "seed": seed,
+    }
+
+
+# ------------------------------------------------------------
+# 冷启动
+# ------------------------------------------------------------
+# 在全新的解释器里执行：只能用内联的小信号，导入 bench 本身会提前导入被测模块
+_STARTUP_CHILD = """
+import json, sys, time
+warm = sys.argv[1] == "warm"
+timings = {}
+start = time.perf_counter()
+import numpy as np
+import cache, metrics, utils, streaming, features, vault, worker
+timings["startup_import"] = time.perf_counter() - start
+start = time.perf_counter()
+import ui_components
+timings["startup_import_ui"] = time.perf_counter() - start
+if warm:
+    start = time.perf_counter()
+    utils.warm_up()
+    features.warm_up()
+    timings["startup_warm_up"] = time.perf_counter() - start
+suffix = "_warm" if warm else ""
+sr = 22050
+y = (0.1 * np.sin(2 * np.pi * 220 * np.arange(sr) / sr)).astype(np.float32)
+start = time.perf_counter()
+utils.process_audio_speed_and_pitch(y, 1.5, sr)
+timings["startup_first_render" + suffix] = time.perf_counter() - start
+start = time.perf_counter()
+features.extract_features(y, sr)
+timings["startup_first_features" + suffix] = time.perf_counter() - start
+print(json.dumps(timings))
+"""
+
+
+def run_startup(repeat: int = 3) -> dict:
+    """
+    每次新开一个解释器，测量导入、预热以及第一次处理 / 特征提取的耗时；
+    不预热与先预热各跑 repeat 次，取最小值与平均值。
+    numba 的磁盘缓存会在进程之间保留，这里测到的正是服务重启后的真实情况。
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples = {}
+    for mode in ("cold", "warm"):
+        for _ in range(repeat):
+            proc = subprocess.run([sys.executable, "-c", _STARTUP_CHILD, mode], cwd=here,
+                                  capture_output=True, text=True, check=True)
+            for stage, seconds in json.loads(proc.stdout.strip().splitlines()[-1]).items():
+                samples.setdefault(stage, []).append(seconds)
+
+    results = []
+    for stage in STARTUP_STAGES:
+        times = samples[stage]
+        # 与其它阶段共用 (阶段, 时长, 采样率, 温度) 作为对比键：第一次处理用的是 1 s、22.05 kHz、温度 1.5
+        row = {"stage": stage, "duration": 1, "sr": 22050, "temperature": 1.5, "status": "ok",
+               "seconds": round(min(times), 6), "seconds_mean": round(sum(times) / len(times), 6), "peak_mb": None}
+        results.append(row)
+        print(_format_row(row), flush=True)
+    return {"meta": _meta(repeat, seed=0), "results": results}
+
+
+# ------------------------------------------------------------
+# 与基线对比
+# ------------------------------------------------------------
+def compare(baseline: dict, current: dict, threshold: float = 0.10, min_seconds: float = 0.005) -> list:
+    """
+    按 (阶段, 时长, 采样率, 温度) 对齐两份结果，返回回归列表。
+    耗时或峰值内存超过基线的 (1 + threshold) 倍即视为回归；
+    两边都短于 min_seconds 的阶段计时噪声太大，不参与耗时判断。
+    """
+    def _key(row):
+        return row["stage"], row["duration"], row["sr"], row["temperature"]
+
+    base_rows = {_key(r): r for r in baseline["results"] if r.get("status") == "ok"}
+    regressions = []
+    print(f"{'stage':<28} {'case':<26} {'time':>8} {'memory':>8}")
+    for row in current["results"]:
+        old = base_rows.get(_key(row))
+        if old is None or row.get("status") != "ok":
+            continue
+        case = f"{row['duration']:g}s/{row['sr']}/t={row['temperature']:g}"
+        time_ratio = row["seconds"] / max(old["seconds"], 1e-9)
+        mem_ratio = (row["peak_mb"] / max(old["peak_mb"], 1e-6)
+                     if row.get("peak_mb") is not None and old.get("peak_mb") is not None else None)
+
+        flags = []
+        if time_ratio > 1 + threshold and max(row["seconds"], old["seconds"]) >= min_seconds:
+            flags.append("time")
+        if mem_ratio is not None and mem_ratio > 1 + threshold and row["peak_mb"] - old["peak_mb"] > 1.0:
+            flags.append("memory")
+        mem_text = f"{mem_ratio:>7.2f}x" if mem_ratio is not None else f"{'-':>8}"
+        marker = "  <-- 回归: " + ", ".join(flags) if flags else ""
+        print(f"{row['stage']:<28} {case:<26} {time_ratio:>7.2f}x {mem_text}{marker}")
+        if flags:
+            regressions.append({**row, "baseline": old, "time_ratio": round(time_ratio, 3),
+                                "memory_ratio": round(mem_ratio, 3) if mem_ratio is not None else None,
+                                "regressed": flags})
+    return regressions
+
+
+def _load_json(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="言冰 (Voiceice) 基准测试")
+    parser.add_argument("-d", "--durations", type=float, nargs="+", default=DEFAULT_DURATIONS,
+                        help="信号时长 (秒)，默认 1 10 60 600 3600")
+    parser.add_argument("-r", "--rates", type=int, nargs="+", default=DEFAULT_RATES,
+                        help="采样率，默认 16000 22050 44100 48000")
+    parser.add_argument("-t", "--temperatures", type=float, nargs="+", default=DEFAULT_TEMPERATURES,
+                        help="温度，默认 0.7 1.0 1.5 (覆盖三条分支)")
+    parser.add_argument("-s", "--stages", nargs="+", choices=STAGES, default=list(STAGES), help="只测这些阶段")
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="计时重复次数 (60 s 以上的信号只测一次)")
+    parser.add_argument("--quick", action="store_true", help="快速冒烟：1 s 与 10 s，仅 22050 Hz")
+    parser.add_argument("--no-memory", action="store_true", help="不统计峰值内存 (省去额外的一次运行)")
+    parser.add_argument("--max-offline-seconds", type=float, default=600,
+                        help="超过该时长的信号只测流式管线 (默认 600，与应用一致)")
+    parser.add_argument("--seed", type=int, default=0, help="合成信号的随机种子")
+    parser.add_argument("--startup", action="store_true",
+                        help="改为测量冷启动：每次新开解释器，测导入、预热与第一次处理的耗时")
+    parser.add_argument("-o", "--output", default="bench_results.json", help="结果 JSON 的保存路径")
+    parser.add_argument("--compare", metavar="BASELINE", help="与基线 JSON 对比，有回归时返回码为 1")
+    parser.add_argument("--results", metavar="CURRENT", help="配合 --compare：直接对比已有结果，不重新测量")
+    parser.add_argument("--threshold", type=float, default=0.10, help="回归判定阈值 (默认 0.10 即慢 10%%)")
+    args = parser.parse_args(argv)
+
+    if args.results:
+        if not args.compare:
+            parser.error("--results 需要与 --compare 一起使用")
+        current = _load_json(args.results)
+    elif args.startup:
+        current = run_startup(repeat=args.repeat)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(current, f, ensure_ascii=False, indent=1)
+        print(f"结果已写入 {args.output}")
+    else:
+        durations, rates = ([1, 10], [22050]) if args.quick else (args.durations, args.rates)
+        current = run_suite(durations, rates, args.temperatures, stages=set(args.stages), repeat=args.repeat,
+                            memory=not args.no_memory, max_offline_seconds=args.max_offline_seconds,
+                            seed=args.seed)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(current, f, ensure_ascii=False, indent=1)
+        print(f"结果已写入 {args.output}")
+
+    if args.compare:
+        regressions = compare(_load_json(args.compare), current, threshold=args.threshold)
+        print(f"{len(regressions)} 项回归")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,213 @@
+# cache.py
+import glob
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def content_hash(raw_bytes: bytes) -> str:
+    """
+    计算二进制音频流的内容指纹 (Content Hash)。
+    同一段音频无论叫什么名字、被谁上传，指纹都相同，可以作为缓存的主键。
+    """
+    # blake2b 比 sha256 更快，16 字节摘要对我们的金库规模已经绰绰有余
+    return hashlib.blake2b(raw_bytes, digest_size=16).hexdigest()
+
+
+def file_content_hash(file_path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    流式计算磁盘文件的内容指纹，结果与 content_hash(文件全部字节) 完全一致，
+    但内存占用只有一个分块大小。
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def quantize_temperature(temperature: float) -> float:
+    """
+    将温度量化到滑块的步长精度，避免 0.7000000001 与 0.7 被当成两个不同的键。
+    """
+    return round(float(temperature), 2)
+
+
+def atomic_write(file_path: str, data):
+    """
+    先写同目录下的临时文件再原子替换，读者永远看不到写了一半的文件，中途被杀也只会留下临时文件。
+    data 是要写入的字节，或者一个接收已打开二进制文件的函数 (例如 lambda f: np.save(f, y))，
+    后者可以直接流式写入，不必先在内存里拼出完整的字节串。
+    """
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            if callable(data):
+                data(f)
+            else:
+                f.write(data)
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _sizeof(value) -> int:
+    """估算一个缓存条目占用的字节数 (NumPy 数组按真实缓冲区大小计算)"""
+    if isinstance(value, np.memmap):
+        # 内存映射数组的数据在磁盘/页缓存里，不占用进程堆内存
+        return 64
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if hasattr(value, "nbytes"):
+        # 自带 nbytes 的缓存对象 (例如声谱图金字塔) 自行报告占用
+        return int(value.nbytes)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(_sizeof(v) for v in value)
+    if isinstance(value, dict):
+        return sum(_sizeof(v) for v in value.values())
+    # 其它小对象 (数字、字符串等) 按一个保守的常数计入
+    return 64
+
+
+class LRUByteCache:
+    """
+    按字节预算淘汰的 LRU 缓存，线程安全。
+    Streamlit 的每个会话都跑在独立线程里，因此所有读写都需要加锁。
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = int(max_bytes)
+        self._data = OrderedDict()   # key -> (value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            # 命中后挪到队尾，表示"最近使用"
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = _sizeof(value)
+        # 单个条目比整个预算还大时直接放弃缓存，避免把其它条目全部挤出去
+        if size > self.max_bytes:
+            return value
+
+        # 共享给多个会话的数组一律设为只读，防止某个会话原地修改污染缓存
+        if isinstance(value, np.ndarray):
+            value.flags.writeable = False
+
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (value, size)
+            self._bytes += size
+
+            # 从最久未使用的一端开始淘汰，直到回到预算以内
+            while self._bytes > self.max_bytes and self._data:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+        return value
+
+    def get_or_compute(self, key, compute_fn):
+        """命中则直接返回，未命中则调用 compute_fn() 计算并写入缓存"""
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, compute_fn())
+        return value
+
+    def discard(self, key):
+        """主动移除某个条目 (例如底层数据已被删除)，不存在时静默忽略"""
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+    def discard_matching(self, predicate) -> int:
+        """移除所有键满足 predicate(键) 的条目 (例如某段音频的全部派生结果)，返回移除的条目数"""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                self._bytes -= self._data.pop(key)[1]
+        return len(keys)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    @property
+    def current_bytes(self) -> int:
+        return self._bytes
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+
+def pcm_cache_dir(vault_dir: str) -> str:
+    """
+    解码缓存目录：默认与金库放在一起 (<金库>/.pcm_cache)，
+    设置了环境变量 VOICEICE_PCM_CACHE_DIR 时 (例如多 worker 部署指向共享磁盘) 以它为准。
+    界面与离线补算都从这里取路径，两边复用同一份解码结果。
+    """
+    return os.environ.get("VOICEICE_PCM_CACHE_DIR", os.path.join(vault_dir, ".pcm_cache"))
+
+
+class PcmDiskCache:
+    """
+    解码后音频的磁盘缓存：<缓存目录>/<内容指纹>_<采样率>.npy (单声道 float32)。
+
+    读取时使用内存映射 (mmap)，不会把整段音频拷进进程内存；
+    进程重启或多个 worker 进程共享同一目录时，都能直接复用，不必再付一次解码代价。
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _find(self, audio_hash: str):
+        matches = glob.glob(os.path.join(self.cache_dir, f"{audio_hash}_*.npy"))
+        return matches[0] if matches else None
+
+    def load(self, audio_hash: str):
+        """命中则返回 (只读内存映射数组, 采样率)，否则返回 None"""
+        file_path = self._find(audio_hash)
+        if file_path is None:
+            return None
+        sr = int(os.path.basename(file_path)[len(audio_hash) + 1:-len(".npy")])
+        try:
+            return np.load(file_path, mmap_mode="r"), sr
+        except (OSError, ValueError):
+            # 文件损坏 (例如写入时进程被杀) 时当作未命中，稍后会被重新写入
+            return None
+
+    def store(self, audio_hash: str, y: np.ndarray, sr: int):
+        """原子写入一段解码结果，并返回它的内存映射版本"""
+        file_path = os.path.join(self.cache_dir, f"{audio_hash}_{int(sr)}.npy")
+        atomic_write(file_path, lambda f: np.save(f, np.ascontiguousarray(y, dtype=np.float32)))
+        return np.load(file_path, mmap_mode="r"), int(sr)
+
+    def discard(self, audio_hash: str):
+        """对应的音频已从金库删除时，顺手清理其解码缓存"""
+        file_path = self._find(audio_hash)
+        if file_path is not None and os.path.exists(file_path):
+            os.remove(file_path)
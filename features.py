@@ -0,0 +1,346 @@
+# features.py
+"""
+录音的声学特征：响度 (RMS)、频谱质心、过零率、语速与音高 (pYIN) 统计。
+
+    feats = features.extract_features(y, sr)     # {"rms_db": ..., "pitch_median_hz": ..., ...}
+    store = features.FeatureStore("local_ice_vault/.features")
+    store.put(audio_hash, 0.7, feats)
+
+- 所有信号先统一降采样到 ANALYSIS_SR，同一段音频无论来自哪个质量档位，特征都可以按 (内容指纹, 温度) 共用
+- 帧级特征 (RMS / 过零率 / 质心) 在一次分帧上分块向量化计算，内存只取决于块大小
+- pYIN 是最贵的一步：帧移取 20 ms，超长录音只分析均匀分布的若干片段
+- 结果按内容指纹落盘到金库旁边的 .features 目录，进程重启后解语手札仍然是秒开
+
+整个金库的离线补算 (多进程并行)：
+
+    python features.py local_ice_vault -j 8
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+import cache
+import metrics
+import utils
+import vault
+import worker
+
+# 特征算法的版本号；算法变化时加一，旧的落盘结果自动作废
+FEATURES_VERSION = 1
+
+# 分析采样率与帧参数：10 ms 帧移，64 ms 帧长
+ANALYSIS_SR = 16000
+FRAME_LENGTH = 1024
+HOP_LENGTH = 160
+# 分块计算帧级特征时每块的帧数
+BLOCK_FRAMES = 4096
+
+# pYIN 参数：人声基频范围 (Hz)，帧移 20 ms
+PITCH_FMIN, PITCH_FMAX = 65.0, 600.0
+PITCH_HOP_LENGTH = 320
+# 超过这个时长 (秒) 的录音只抽取若干段做音高分析
+PITCH_MAX_SECONDS = 120.0
+PITCH_EXCERPT_SECONDS = 10.0
+
+# 低于最响帧这么多 dB (或低于绝对下限) 的帧视为静音，不计入统计
+SILENCE_RANGE_DB = 40.0
+SILENCE_FLOOR_DB = -60.0
+# 超过这个时长 (秒) 的静音算作停顿，不计入说话时长
+PAUSE_SECONDS = 0.3
+
+# 特征文件在金库目录下的存放位置 (以点号开头，金库扫描音频时会跳过)
+FEATURES_DIR_NAME = ".features"
+
+
+def _to_analysis_rate(y: np.ndarray, sr: int) -> np.ndarray:
+    y = np.asarray(y, dtype=np.float32)
+    if sr == ANALYSIS_SR:
+        return y
+    import librosa
+    return librosa.resample(y, orig_sr=sr, target_sr=ANALYSIS_SR, res_type="soxr_hq")
+
+
+def _frame_features(y: np.ndarray) -> tuple:
+    """
+    一次分帧 (零拷贝视图) 上同时计算逐帧 RMS、过零率与频谱质心。
+    按 BLOCK_FRAMES 分块，每块内完全向量化，避免一次性展开整段录音的帧矩阵。
+    """
+    import librosa
+    padded = np.pad(y, FRAME_LENGTH // 2)
+    if len(padded) < FRAME_LENGTH:
+        padded = np.pad(padded, (0, FRAME_LENGTH - len(padded)))
+    # (帧数, 帧长) 的只读视图
+    frames = librosa.util.frame(padded, frame_length=FRAME_LENGTH, hop_length=HOP_LENGTH, axis=0)
+    n_frames = len(frames)
+    window = np.hanning(FRAME_LENGTH).astype(np.float32)
+    freqs = np.fft.rfftfreq(FRAME_LENGTH, d=1.0 / ANALYSIS_SR).astype(np.float32)
+
+    rms = np.empty(n_frames, dtype=np.float32)
+    zcr = np.empty(n_frames, dtype=np.float32)
+    centroid = np.empty(n_frames, dtype=np.float32)
+    for start in range(0, n_frames, BLOCK_FRAMES):
+        block = frames[start:start + BLOCK_FRAMES]
+        stop = start + len(block)
+        rms[start:stop] = np.sqrt(np.mean(np.square(block), axis=1))
+        zcr[start:stop] = np.count_nonzero(np.diff(np.signbit(block), axis=1), axis=1) / FRAME_LENGTH
+        mag = np.abs(np.fft.rfft(block * window, axis=1)).astype(np.float32)
+        centroid[start:stop] = (mag @ freqs) / np.maximum(mag.sum(axis=1), 1e-10)
+    return rms, zcr, centroid
+
+
+def _speaking_rate(rms_db: np.ndarray, active: np.ndarray):
+    """
+    语速估计 (音节/秒)：平滑后的响度包络上每个显著的峰视为一个音节核，
+    除以说话时长；相邻音节核至少间隔 100 ms。
+    说话时长只扣除 PAUSE_SECONDS 以上的停顿，音节之间的短暂低谷照常计入，
+    这样结果不会随响度压缩 (例如饱和失真) 抬高低谷而变化。
+    """
+    frames_per_second = ANALYSIS_SR / HOP_LENGTH
+    # 相邻有声帧之间的间隔 (帧)，超过停顿阈值的部分不计入说话时长
+    active_idx = np.flatnonzero(active)
+    if len(active_idx) == 0:
+        return None
+    gaps = np.diff(active_idx) - 1
+    pauses = gaps[gaps >= PAUSE_SECONDS * frames_per_second].sum()
+    speech_seconds = (active_idx[-1] - active_idx[0] + 1 - pauses) / frames_per_second
+    if speech_seconds < 0.5:
+        return None
+    # 50 ms 滑动平均，去掉基频周期带来的细碎起伏
+    width = int(0.05 * frames_per_second)
+    envelope = np.convolve(rms_db, np.ones(width, dtype=np.float32) / width, mode="same")
+    floor = max(float(rms_db.max()) - SILENCE_RANGE_DB, SILENCE_FLOOR_DB)
+    from scipy import signal
+    peaks, _ = signal.find_peaks(envelope, height=floor, prominence=3.0, distance=int(0.1 * frames_per_second))
+    return float(len(peaks) / speech_seconds)
+
+
+def _pitch_excerpts(y: np.ndarray) -> list:
+    """音高分析的输入：不太长的录音整段分析，超长录音取均匀分布的若干片段"""
+    total = len(y) / ANALYSIS_SR
+    if total <= PITCH_MAX_SECONDS:
+        return [y]
+    n_excerpts = int(PITCH_MAX_SECONDS // PITCH_EXCERPT_SECONDS)
+    excerpt_len = int(PITCH_EXCERPT_SECONDS * ANALYSIS_SR)
+    starts = np.linspace(0, len(y) - excerpt_len, n_excerpts).astype(int)
+    return [y[s:s + excerpt_len] for s in starts]
+
+
+def _pitch_stats(y: np.ndarray) -> dict:
+    import librosa
+    f0_parts, n_frames, seconds = [], 0, 0.0
+    for excerpt in _pitch_excerpts(y):
+        if len(excerpt) < FRAME_LENGTH:
+            continue
+        f0, voiced, _ = librosa.pyin(excerpt, fmin=PITCH_FMIN, fmax=PITCH_FMAX, sr=ANALYSIS_SR,
+                                     frame_length=FRAME_LENGTH, hop_length=PITCH_HOP_LENGTH)
+        f0_parts.append(f0[voiced & np.isfinite(f0)])
+        n_frames += len(f0)
+        seconds += len(excerpt) / ANALYSIS_SR
+    f0 = np.concatenate(f0_parts) if f0_parts else np.zeros(0)
+
+    stats = {"pitch_median_hz": None, "pitch_p10_hz": None, "pitch_p90_hz": None,
+             "pitch_range_semitones": None, "voiced_ratio": None, "pitch_seconds_analyzed": round(seconds, 3)}
+    if n_frames:
+        stats["voiced_ratio"] = len(f0) / n_frames
+    if len(f0):
+        p10, p50, p90 = np.percentile(f0, [10, 50, 90])
+        stats.update(pitch_median_hz=float(p50), pitch_p10_hz=float(p10), pitch_p90_hz=float(p90),
+                     pitch_range_semitones=float(12 * np.log2(p90 / p10)))
+    return stats
+
+
+@metrics.timed("extract_features")
+def extract_features(y: np.ndarray, sr: int) -> dict:
+    """
+    计算一段音频的声学特征摘要 (所有值都是可以直接写入 JSON 的 float / None)。
+
+    Returns:
+        dict: duration, rms_db, centroid_hz, zcr, speaking_rate,
+              pitch_median_hz, pitch_p10_hz, pitch_p90_hz, pitch_range_semitones, voiced_ratio
+    """
+    y = _to_analysis_rate(y, sr)
+    rms, zcr, centroid = _frame_features(y)
+    rms_db = 20 * np.log10(np.maximum(rms, 1e-10))
+    # 只统计有声帧，避免开头结尾的静音把数字拉偏
+    active = rms_db > max(float(rms_db.max()) - SILENCE_RANGE_DB, SILENCE_FLOOR_DB)
+
+    result = {"duration": round(len(y) / ANALYSIS_SR, 3), "rms_db": None, "centroid_hz": None, "zcr": None}
+    if active.any():
+        result.update(
+            # 有声段的平均能量换算成 dBFS
+            rms_db=float(10 * np.log10(np.mean(np.square(rms[active], dtype=np.float64)))),
+            centroid_hz=float(np.median(centroid[active])),
+            zcr=float(np.mean(zcr[active])),
+        )
+    result["speaking_rate"] = _speaking_rate(rms_db, active)
+    result.update(_pitch_stats(y))
+    return result
+
+
+def warm_up(seconds: float = 1.0) -> float:
+    """
+    在一小段合成信号上跑一遍特征提取，返回耗时 (秒)。
+    pYIN 依赖的 numba 函数第一次调用时要编译 (或从磁盘缓存加载)，首次可达十几秒。
+    """
+    t = np.arange(int(ANALYSIS_SR * seconds)) / ANALYSIS_SR
+    y = (0.1 * np.sin(2 * np.pi * 150 * t)).astype(np.float32)
+    start = time.perf_counter()
+    extract_features(y, ANALYSIS_SR)
+    return round(time.perf_counter() - start, 6)
+
+
+class FeatureStore:
+    """
+    特征的持久化存储：<目录>/<内容指纹>.json = {"version": ..., "temperatures": {"0.7": {...}, ...}}
+
+    同一段音频的所有温度放在一个文件里，删除音频时一次清理干净。
+    所有会话共用同一个实例 (由 main.py 的 @st.cache_resource 托管)，读过的文件留在内存里；
+    写入时重新读一遍磁盘上的版本再合并，离线补算与界面同时写同一个文件也不会互相覆盖。
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        self._entries = {}   # 内容指纹 -> (文件修改时间, {量化温度字符串: 特征})
+        self._lock = threading.Lock()
+
+    def _path(self, audio_hash: str) -> str:
+        return os.path.join(self.store_dir, f"{audio_hash}.json")
+
+    def _mtime(self, audio_hash: str):
+        try:
+            return os.stat(self._path(audio_hash)).st_mtime_ns
+        except OSError:
+            return None
+
+    def _read(self, audio_hash: str) -> dict:
+        try:
+            with open(self._path(audio_hash), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get("version") != FEATURES_VERSION:
+            return {}
+        return data.get("temperatures", {})
+
+    def _entry(self, audio_hash: str) -> dict:
+        """内存里的副本；文件在别处 (例如离线补算进程) 被改写过时重新读取"""
+        mtime = self._mtime(audio_hash)
+        cached = self._entries.get(audio_hash)
+        if cached is None or cached[0] != mtime:
+            cached = self._entries[audio_hash] = (mtime, self._read(audio_hash))
+        return cached[1]
+
+    @staticmethod
+    def _temp_key(temperature: float) -> str:
+        return f"{cache.quantize_temperature(temperature):.2f}"
+
+    def get(self, audio_hash: str, temperature: float):
+        """命中返回特征字典，否则返回 None"""
+        with self._lock:
+            return self._entry(audio_hash).get(self._temp_key(temperature))
+
+    def missing(self, audio_hash: str, temperatures) -> list:
+        return [t for t in temperatures if self.get(audio_hash, t) is None]
+
+    def put_many(self, audio_hash: str, features_by_temperature: dict):
+        """一次写入同一段音频的多个温度 {温度: 特征}"""
+        with self._lock:
+            entry = dict(self._read(audio_hash))
+            entry.update({self._temp_key(t): f for t, f in features_by_temperature.items()})
+            payload = json.dumps({"version": FEATURES_VERSION, "temperatures": entry}, ensure_ascii=False, indent=1)
+            cache.atomic_write(self._path(audio_hash), payload.encode("utf-8"))
+            self._entries[audio_hash] = (self._mtime(audio_hash), entry)
+
+    def put(self, audio_hash: str, temperature: float, features: dict):
+        self.put_many(audio_hash, {temperature: features})
+
+    def discard(self, audio_hash: str):
+        """对应的音频已从金库删除时，连同特征文件一起清理"""
+        with self._lock:
+            self._entries.pop(audio_hash, None)
+            file_path = self._path(audio_hash)
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+
+# ------------------------------------------------------------
+# 整个金库的离线补算
+# ------------------------------------------------------------
+def _backfill_job(vault_dir: str, pcm_cache_dir: str, audio_hash: str, temperatures) -> dict:
+    """
+    在 worker 进程里执行：解码一段音频 (优先复用解码缓存)，在 16 kHz 试听档位上
+    逐个渲染所需的温度并提取特征。必须是模块级函数，才能被进程池序列化后分发。
+    """
+    cached = cache.PcmDiskCache(pcm_cache_dir).load(audio_hash) if os.path.isdir(pcm_cache_dir) else None
+    if cached is not None:
+        y, sr = cached
+    else:
+        y, sr = utils.decode_audio_bytes(vault.read_blob_bytes(vault_dir, audio_hash))
+
+    # 特征本来就在 ANALYSIS_SR 上计算，渲染也放在同采样率的试听档位上，代价只有原始采样率的几分之一
+    y_tier, sr_tier = utils.resample_for_tier(y, sr, "preview")
+    results = {}
+    if 1.0 in temperatures:
+        results[1.0] = extract_features(y_tier, sr_tier)
+    _, n_fft = utils.tier_params(sr, "preview")
+    for t in temperatures:
+        if t != 1.0:
+            results[t] = extract_features(utils.process_audio_speed_and_pitch(y_tier, t, sr_tier, n_fft=n_fft), sr_tier)
+    return results
+
+
+def backfill(vault_dir: str, temperatures=None, workers: int = None, force: bool = False) -> int:
+    """
+    为金库里的每段音频补算缺失的 (温度, 特征)，按音频分发到进程池并行执行。
+    只读取金库清单，不修改金库本身。
+
+    Returns:
+        失败的音频数 (0 表示全部成功)
+    """
+    temperatures = sorted({cache.quantize_temperature(t) for t in (temperatures or utils.TEMPERATURE_GRID)})
+    try:
+        with open(os.path.join(vault_dir, vault.MANIFEST_NAME), "r", encoding="utf-8") as f:
+            blobs = json.load(f).get("blobs", {})
+    except (OSError, ValueError):
+        blobs = {}
+    store = FeatureStore(os.path.join(vault_dir, FEATURES_DIR_NAME))
+    pcm_cache_dir = cache.pcm_cache_dir(vault_dir)
+
+    # 1. 每段音频只派发缺失的温度，已经齐全的直接跳过
+    jobs = []
+    for audio_hash, record in blobs.items():
+        todo = temperatures if force else store.missing(audio_hash, temperatures)
+        if todo:
+            jobs.append((record.get("size", 0), audio_hash, (vault_dir, pcm_cache_dir, audio_hash, todo)))
+    print(f"{len(jobs)} 段音频待补算，{len(blobs) - len(jobs)} 段已齐全")
+
+    # 2. 分发到进程池，每完成一段就落盘一次
+    def _record(audio_hash, results):
+        store.put_many(audio_hash, results)
+        return f"{audio_hash} ({len(results)} 个温度)"
+
+    return worker.run_process_jobs(_backfill_job, jobs, _record, workers=workers)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="言冰 (Voiceice) 金库声学特征补算")
+    parser.add_argument("vault_dir", help="金库目录 (默认部署下为 local_ice_vault)")
+    parser.add_argument("-t", "--temperatures", type=float, nargs="+", default=None,
+                        help="要补算的温度档位 (默认: 滑块上的全部档位)")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="并行进程数 (默认: CPU 核数)")
+    parser.add_argument("--force", action="store_true", help="忽略已有结果，全部重新计算")
+    args = parser.parse_args(argv)
+
+    failures = backfill(args.vault_dir, args.temperatures, workers=args.workers, force=args.force)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
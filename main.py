@@ -1,30 +1,365 @@
 # main.py
 import streamlit as st
-import librosa
 import utils           # 导入我们的工具箱
 import ui_components   # 导入我们的UI组件
+import cache           # 导入跨会话共享的缓存层
+import vault           # 导入按内容寻址的共享金库
+import streaming       # 导入长录音用的流式处理管线
+import metrics         # 导入分阶段计时埋点
+import worker          # 导入后台渲染线程池
+import features        # 导入声学特征提取与持久化
+import numpy as np
 import io
 import datetime
-import tempfile
+import glob
 import os
+import threading
+import time
+
+@st.cache_resource
+def get_pcm_cache():
+    """解码结果的磁盘缓存 (float32 .npy + mmap)，进程重启与多 worker 之间都能复用"""
+    return cache.PcmDiskCache(PCM_CACHE_DIR)
 
 # 使用装饰器，并添加一个友好的加载提示动画
-@st.cache_data(show_spinner="⏳ 正在凝结底层冰晶 (解码音频)...")
-def load_audio_from_bytes(audio_bytes):
+# 这里用 cache_resource 而不是 cache_data：返回的是只读内存映射数组，
+# 所有会话直接共享同一个对象，不会被序列化复制成一份份完整的内存拷贝
+@st.cache_resource(show_spinner="⏳ 正在凝结底层冰晶 (解码音频)...", max_entries=64)
+def load_audio_from_bytes(audio_hash, _read_bytes):
     """
     将二进制音频流解码为 NumPy 数组。
-    由于有 @st.cache_data 护航，相同的 audio_bytes 只会被解码一次。
+    先查磁盘上的解码缓存，命中则直接内存映射；未命中才真正解码并写回磁盘。
+    _read_bytes 以下划线开头，不参与缓存键的哈希，只有未命中时才会被调用去读盘。
     """
-    # 使用 tempfile 在系统临时目录安全地创建一个无名文件，避免多线程冲突
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-        tmp.write(audio_bytes)
-        tmp_path = tmp.name
-        
-    # 执行极其耗时的解码操作
-    y, sr = librosa.load(tmp_path, sr=None)
+    pcm_cache = get_pcm_cache()
+    cached = pcm_cache.load(audio_hash)
+    if cached is not None:
+        return cached
+
+    # 执行极其耗时的解码操作 (直接从内存缓冲区解码，不再落地临时文件)
+    y, sr = utils.decode_audio_bytes(_read_bytes())
     
-    # 返回解码后的纯净数据
-    return y, sr
+    # 写回磁盘缓存，返回内存映射的只读版本
+    return pcm_cache.store(audio_hash, y, sr)
+
+@st.cache_resource
+def get_preview_pcm_cache():
+    """试听档位的降采样副本，与原始解码结果分目录存放，同样以内存映射复用"""
+    return cache.PcmDiskCache(PREVIEW_CACHE_DIR)
+
+@st.cache_resource(show_spinner="⏳ 正在准备试听副本 (降采样)...", max_entries=64)
+def load_tier_source(audio_hash, tier, _y, _sr):
+    """
+    某个质量档位的输入音频，按 (内容指纹, 档位) 缓存。
+    final 档位就是原始解码结果；preview 档位是降采样副本，首次生成后落盘，进程重启也能复用。
+    """
+    tier_sr, _ = utils.tier_params(_sr, tier)
+    if tier_sr == _sr:
+        return _y, _sr
+
+    preview_cache = get_preview_pcm_cache()
+    cached = preview_cache.load(audio_hash)
+    if cached is not None and cached[1] == tier_sr:
+        return cached
+    y_tier, tier_sr = utils.resample_for_tier(_y, _sr, tier)
+    return preview_cache.store(audio_hash, y_tier, tier_sr)
+
+# 处理结果缓存的内存预算 (MB)，可通过环境变量调整
+RENDER_CACHE_MB = int(os.environ.get("VOICEICE_RENDER_CACHE_MB", "512"))
+
+@st.cache_resource
+def get_render_cache():
+    """
+    全进程共享的处理结果缓存：{(内容指纹, 量化温度): 处理后的音频}。
+    @st.cache_resource 保证所有浏览器会话拿到的是同一个对象，而不是各自一份。
+    """
+    return cache.LRUByteCache(max_bytes=RENDER_CACHE_MB * 1024 * 1024)
+
+# 可视化产物 (声谱图金字塔等) 缓存的内存预算 (MB)
+ARTIFACT_CACHE_MB = int(os.environ.get("VOICEICE_ARTIFACT_CACHE_MB", "128"))
+
+@st.cache_resource
+def get_artifact_cache():
+    """
+    全进程共享的可视化产物缓存，与音频处理结果分开计算预算，
+    避免体积小但数量多的图表数据把昂贵的音频渲染结果挤出去。
+    """
+    return cache.LRUByteCache(max_bytes=ARTIFACT_CACHE_MB * 1024 * 1024)
+
+def get_spectrogram_pyramid(y, sr, audio_hash, temperature, tier):
+    """按 (内容指纹, 温度, 档位) 缓存声谱图金字塔；原始音频即温度 1.0，与处理结果共用同一个键"""
+    key = ("spectrogram", audio_hash, cache.quantize_temperature(temperature), tier)
+    return get_artifact_cache().get_or_compute(key, lambda: utils.SpectrogramPyramid(y, sr))
+
+def get_waveform_pyramid(y, sr, audio_hash, temperature, tier):
+    """按 (内容指纹, 温度, 档位) 缓存波形包络金字塔，与声谱图共用可视化产物缓存"""
+    key = ("waveform", audio_hash, cache.quantize_temperature(temperature), tier)
+    return get_artifact_cache().get_or_compute(key, lambda: utils.WaveformPyramid(y, sr))
+
+# 编码后播放数据缓存的内存预算 (MB)
+PLAYBACK_CACHE_MB = int(os.environ.get("VOICEICE_PLAYBACK_CACHE_MB", "64"))
+
+@st.cache_resource
+def get_playback_cache():
+    """全进程共享的播放数据缓存：{(内容指纹, 量化温度, 档位, 格式, 质量): (编码后的字节, MIME)}"""
+    return cache.LRUByteCache(max_bytes=PLAYBACK_CACHE_MB * 1024 * 1024)
+
+def _playback_variant(fmt, quality):
+    """
+    编码结果的格式部分键：只有 OGG 的质量会改变听到的声音；
+    FLAC 无损 (质量只影响压缩力度)，WAV 的质量滑块是禁用的，都不必按质量分别缓存。
+    """
+    return f"{fmt}_{round(float(quality), 1)}" if fmt == "OGG" else fmt
+
+def get_playback_blob(y, sr, audio_hash, temperature, tier, fmt, quality):
+    """
+    按 (内容指纹, 温度, 档位, 格式[, OGG 质量]) 缓存编码结果，重跑脚本时不再重复编码。
+    超出内存缓存预算的编码结果 (长录音) 落盘到 PLAYBACK_DIR，返回 (文件路径, MIME)，
+    st.audio 直接按路径读取，既不占内存缓存也不必在每次重跑时重新编码。
+    """
+    qtemp = cache.quantize_temperature(temperature)
+    variant = _playback_variant(fmt, quality)
+    key = ("playback", audio_hash, qtemp, tier, variant)
+    playback_cache = get_playback_cache()
+
+    # 1. 内存缓存命中
+    cached = playback_cache.get(key)
+    if cached is not None:
+        return cached
+
+    # 2. 磁盘上已有同一键的编码结果
+    mime = utils.PLAYBACK_FORMATS[fmt][2]
+    blob_path = os.path.join(PLAYBACK_DIR, f"{audio_hash}_{qtemp}_{tier}_{variant}.{fmt.lower()}")
+    if os.path.exists(blob_path):
+        return blob_path, mime
+
+    # 3. 编码；放得进内存缓存就放进去，否则写盘
+    data, mime = utils.encode_playback(y, sr, fmt, quality)
+    if len(data) <= playback_cache.max_bytes:
+        return playback_cache.put(key, (data, mime))
+    cache.atomic_write(blob_path, data)
+    return blob_path, mime
+
+# 超过这个时长 (秒) 的录音改走流式管线，避免整段处理时的多份全尺寸中间数组
+LONG_AUDIO_SECONDS = float(os.environ.get("VOICEICE_LONG_AUDIO_SECONDS", "600"))
+
+def is_long_audio(y, sr):
+    return len(y) > LONG_AUDIO_SECONDS * sr
+
+# 长录音渲染期间先放出来试听的开头时长 (秒)
+PARTIAL_PREVIEW_SECONDS = float(os.environ.get("VOICEICE_PARTIAL_PREVIEW_SECONDS", "60"))
+
+@st.cache_resource
+def get_render_progress():
+    """全进程共享的长录音渲染进度：{(内容指纹, 量化温度, 档位): (已写采样数, 总采样数)}"""
+    return {}
+
+def _render_path(audio_hash, qtemp, tier):
+    return os.path.join(RENDER_DIR, f"{audio_hash}_{qtemp}_{tier}.npy")
+
+def _compute_render(y, sr, temperature, audio_hash, tier, cancel=None):
+    """
+    真正的 DSP 处理；不调用任何 Streamlit 接口，可以放在后台线程里执行。
+    长录音的流式处理在每块之间检查 cancel，被顶替时抛出 worker.RenderCancelled
+    """
+    qtemp = cache.quantize_temperature(temperature)
+    _, n_fft = utils.tier_params(sr, tier)
+    if is_long_audio(y, sr) and qtemp != 1.0:
+        # 长录音按块流式处理并增量写入内存映射文件，峰值内存只取决于块大小；
+        # 每写完一块登记一次进度，界面据此先放出已经写好的开头
+        out_path = _render_path(audio_hash, qtemp, tier)
+        if not os.path.exists(out_path):
+            key = (audio_hash, qtemp, tier)
+            progress = get_render_progress()
+            try:
+                streaming.process_file_streaming(
+                    y, out_path, temperature, sr=sr, n_fft=n_fft,
+                    progress=lambda written, total: progress.__setitem__(key, (written, total)),
+                    cancel=cancel,
+                )
+            finally:
+                progress.pop(key, None)
+        return np.load(out_path, mmap_mode="r")
+    return utils.process_audio_speed_and_pitch(y, temperature, sr, n_fft=n_fft)
+
+def get_partial_preview(audio_hash, temperature, tier, sr, fmt, quality):
+    """
+    长录音正在流式渲染时的进度与开头试听：(已写采样数, 总采样数, 开头的播放数据或 None)。
+    开头写满 PARTIAL_PREVIEW_SECONDS 秒 (或整段) 后只编码一次；没有进行中的渲染时返回 None。
+    """
+    qtemp = cache.quantize_temperature(temperature)
+    state = get_render_progress().get((audio_hash, qtemp, tier))
+    if state is None:
+        return None
+    written, total = state
+    n_head = min(total, int(PARTIAL_PREVIEW_SECONDS * sr))
+    if written < n_head:
+        return written, total, None
+    key = ("partial", audio_hash, qtemp, tier, _playback_variant(fmt, quality), n_head)
+
+    def _encode():
+        head = np.load(streaming.partial_path(_render_path(audio_hash, qtemp, tier)), mmap_mode="r")[:n_head]
+        return utils.encode_playback(head, sr, fmt, quality)
+
+    try:
+        return written, total, get_playback_cache().get_or_compute(key, _encode)
+    except (OSError, ValueError):
+        # 渲染恰好在这期间结束、临时文件已改名：下一次重跑直接拿到完整结果
+        return written, total, None
+
+# 后台渲染线程数；缓存未命中时脚本先等这么久 (秒)，算得快的档位仍在同一次重跑里直接显示
+RENDER_WORKERS = int(os.environ.get("VOICEICE_RENDER_WORKERS", "0")) or None
+RENDER_WAIT_SECONDS = float(os.environ.get("VOICEICE_RENDER_WAIT_SECONDS", "0.3"))
+# 后台仍有任务时，隔多久自动重跑一次把新结果换上来
+RENDER_POLL_SECONDS = 0.5
+
+@st.cache_resource
+def get_render_pool():
+    """全进程共享的渲染线程池，只跑滑块触发的渲染；每个会话同一时刻最多占用其中一个线程"""
+    return worker.RenderWorkerPool(max_workers=RENDER_WORKERS)
+
+@st.cache_resource
+def get_background_pool():
+    """
+    预渲染与声学特征用的低优先级线程池：全进程只有一个线程，
+    这些可有可无的后台任务排队执行，不会挤占滑块渲染的线程
+    """
+    return worker.RenderWorkerPool(max_workers=1, name="background")
+
+def render_processed(y, sr, temperature, audio_hash, tier):
+    """
+    带缓存的 DSP 处理：来回拖动滑块回到听过的温度时，直接查表而不是重算。
+    y / sr 是该档位的输入 (见 load_tier_source)，两个档位的结果分别缓存、互不覆盖。
+
+    缓存未命中时交给后台线程池，新请求会顶替本会话还没开始的旧请求；
+    新结果出来之前继续显示同一段音频、同一档位最近一次完成的结果。
+
+    Returns:
+        (处理结果, 该结果对应的温度, 后台是否仍有任务)；长录音还没有任何可显示的结果时处理结果为 None
+    """
+    qtemp = cache.quantize_temperature(temperature)
+    key = (audio_hash, qtemp, tier)
+    render_cache = get_render_cache()
+    if 'render_slot' not in st.session_state:
+        st.session_state['render_slot'] = worker.RenderSlot()
+    slot = st.session_state['render_slot']
+
+    # 1. 共享缓存命中：直接显示，并作废排队中的过时请求
+    cached = render_cache.get(key)
+    if cached is not None:
+        slot.show(key, cached)
+        return cached, qtemp, slot.busy
+
+    # 2. 提交到后台，并短暂等待
+    def _job(cancel):
+        return render_cache.get_or_compute(key, lambda: _compute_render(y, sr, temperature, audio_hash, tier, cancel))
+
+    get_render_pool().request(slot, key, _job)
+    if slot.wait(key, RENDER_WAIT_SECONDS):
+        return slot.latest()[1], qtemp, slot.busy
+
+    # 3. 还没算完：有同一段音频、同一档位的旧结果就先顶上
+    done_key, done_value = slot.latest()
+    if done_key is not None and done_key[0] == audio_hash and done_key[2] == tier:
+        return done_value, done_key[1], True
+
+    # 4. 刚切换文件或档位，没有可以顶上的结果：长录音不阻塞，返回 None，由界面先放出已经写好的开头；
+    #    其余情况等它算完
+    if is_long_audio(y, sr):
+        return None, qtemp, True
+    with st.spinner("🔥 正在渲染..."):
+        finished = slot.wait(key)
+    if not finished:
+        if slot.error is not None and slot.error[0] == key:
+            raise slot.error[1]
+        # 等待期间被更新的请求顶替：同步算出当前这一档
+        return render_cache.get_or_compute(key, lambda: _compute_render(y, sr, temperature, audio_hash, tier)), qtemp, slot.busy
+    return slot.latest()[1], qtemp, slot.busy
+
+@st.cache_resource
+def get_feature_store():
+    """全进程共享的声学特征存储，按内容指纹落盘在金库旁边"""
+    return features.FeatureStore(FEATURES_DIR)
+
+def get_features(y, sr, y_processed, sr_processed, audio_hash, temperature):
+    """
+    解语手札用的 (原始, 处理后) 声学特征，按 (内容指纹, 温度) 持久化缓存。
+    缺失时交给后台线程池计算 (pYIN 很慢，不能卡住脚本线程)，算好之前对应一侧为 None。
+    原始音频就是温度 1.0；特征统一在 16 kHz 上计算，试听与精修档位共用同一份结果。
+
+    Returns:
+        (原始特征, 处理后特征, 后台是否仍在计算)
+    """
+    store = get_feature_store()
+    qtemp = cache.quantize_temperature(temperature)
+    original, processed = store.get(audio_hash, 1.0), store.get(audio_hash, qtemp)
+    if original is not None and processed is not None:
+        return original, processed, False
+
+    if 'feature_slot' not in st.session_state:
+        st.session_state['feature_slot'] = worker.RenderSlot()
+    slot = st.session_state['feature_slot']
+    key = (audio_hash, qtemp)
+    if slot.error is not None and slot.error[0] == key:
+        # 同一个任务已经失败过：不再反复重试，报告里显示为暂不可用
+        return original, processed, False
+
+    def _job(cancel):
+        results = {}
+        if original is None:
+            results[1.0] = features.extract_features(y, sr)
+        if processed is None and qtemp != 1.0:
+            # 两侧之间检查一次：已经换了文件或温度就不再算另一侧 (算好的原始一侧照样落盘)
+            if not cancel.is_set():
+                results[qtemp] = features.extract_features(y_processed, sr_processed)
+        store.put_many(audio_hash, results)
+        worker.check_cancelled(cancel)
+        return results
+
+    get_background_pool().request(slot, key, _job)
+    return original, processed, slot.busy
+
+def prerender_temperature_grid(y, sr, audio_hash, tier, temperature):
+    """
+    选中文件后把滑块上其余档位交给后台线程池逐个渲染并写入共享缓存，
+    之后拖动滑块只是查表。当前温度由 render_processed 优先渲染，这里不再重复计算；
+    每个会话对同一段音频只提交一次，即使缓存预算装不下整张网格也不会反复计算。
+    """
+    if st.session_state.get('prerendered_hash') == (audio_hash, tier):
+        return
+    st.session_state['prerendered_hash'] = (audio_hash, tier)
+
+    render_cache = get_render_cache()
+    qtemp = cache.quantize_temperature(temperature)
+    missing = [
+        t for t in utils.TEMPERATURE_GRID
+        if cache.quantize_temperature(t) != qtemp
+        and (audio_hash, cache.quantize_temperature(t), tier) not in render_cache
+    ]
+    if not missing:
+        return
+
+    # 1. 估算整张网格的体积 (每档 ≈ 原长 / 播放速率)，超出缓存预算时算完也存不下，直接跳过
+    grid_bytes = sum(len(y) * y.itemsize / utils._temperature_params(t)[0] for t in missing)
+    if is_long_audio(y, sr) or grid_bytes > RENDER_CACHE_MB * 1024 * 1024:
+        return
+
+    # 2. 交给低优先级的后台线程池：独立的槽位，不会被拖动滑块产生的新请求顶替；换了文件或档位才会取消
+    if 'prerender_slot' not in st.session_state:
+        st.session_state['prerender_slot'] = worker.RenderSlot()
+
+    def _job(cancel):
+        # 与按需渲染走同一个函数，同一个缓存键下永远是同一份音频；每算完一档就写入，滑块随即可以命中
+        for t in missing:
+            worker.check_cancelled(cancel)
+            key = (audio_hash, cache.quantize_temperature(t), tier)
+            try:
+                render_cache.get_or_compute(key, lambda: _compute_render(y, sr, t, audio_hash, tier))
+            except Exception as e:
+                # 预渲染只是加速手段，失败时退回到按需计算
+                print(f"预渲染异常 ({t}): {e}")
+
+    get_background_pool().request(st.session_state['prerender_slot'], ("grid", audio_hash, tier), _job)
 # 1. 页面设置
 st.set_page_config(page_title="言冰 Voiceice", page_icon="🧊", layout="wide")
 
@@ -35,20 +370,101 @@ VAULT_DIR = "local_ice_vault"
 if not os.path.exists(VAULT_DIR):
     os.makedirs(VAULT_DIR)
 
+# 解码缓存目录，默认与金库放在一起，多 worker 部署时可指向共享磁盘
+PCM_CACHE_DIR = cache.pcm_cache_dir(VAULT_DIR)
+
+# 试听档位降采样副本的缓存目录
+PREVIEW_CACHE_DIR = os.path.join(VAULT_DIR, ".preview_cache")
+
+# 声学特征的落盘目录 (离线补算：python features.py local_ice_vault)
+FEATURES_DIR = os.path.join(VAULT_DIR, features.FEATURES_DIR_NAME)
+
+# 长录音流式渲染结果的落盘目录
+RENDER_DIR = os.path.join(VAULT_DIR, ".render_cache")
+os.makedirs(RENDER_DIR, exist_ok=True)
+
+# 超出内存缓存预算的播放编码结果的落盘目录
+PLAYBACK_DIR = os.path.join(VAULT_DIR, ".playback_cache")
+os.makedirs(PLAYBACK_DIR, exist_ok=True)
+
+# 已读入内存的音频块的共享缓存预算 (MB)
+BLOB_CACHE_MB = int(os.environ.get("VOICEICE_BLOB_CACHE_MB", "256"))
+
+# 打开后新入库的 WAV 等整数 PCM 音频会在后台无损转码为 FLAC，追加进金库的打包文件
+VAULT_PACK = os.environ.get("VOICEICE_VAULT_PACK", "0") not in ("", "0")
+
+@st.cache_resource
+def get_vault_store():
+    """
+    全进程唯一的金库实例：所有会话共享同一份索引与同一份音频块缓存，
+    相同内容只存一份，内存随不同音频的数量增长，而不是随会话数增长。
+    """
+    return vault.VaultStore(VAULT_DIR, blob_cache_bytes=BLOB_CACHE_MB * 1024 * 1024, use_pack=VAULT_PACK)
+
+# 埋点打开且设置了端口时，在后台提供 /metrics (Prometheus) 与 /metrics.json 供抓取
+METRICS_PORT = os.environ.get("VOICEICE_METRICS_PORT")
+
+@st.cache_resource
+def start_metrics_server(port):
+    """整个进程只启动一次，所有会话的统计都汇总在同一张表里"""
+    return metrics.serve(port)
+
+if metrics.is_enabled() and METRICS_PORT:
+    start_metrics_server(int(METRICS_PORT))
+
+# 进程启动后在后台预热重型库与 numba JIT (VOICEICE_WARMUP=0 关闭)
+WARMUP = os.environ.get("VOICEICE_WARMUP", "1") not in ("", "0")
+
+def _warm_up():
+    try:
+        with metrics.span("warm_up"):
+            utils.warm_up()
+            features.warm_up()
+    except Exception as e:
+        # 预热只是加速手段，失败时第一次真实请求照常完成这些初始化
+        print(f"预热异常: {e!r}")
+
+@st.cache_resource
+def start_warm_up():
+    """
+    整个进程只预热一次，放在后台线程里，不拖慢第一次页面渲染。
+    它要等第一个浏览器会话打开页面才会开始；部署时在 streamlit run 之前先跑一遍
+    python -c "import utils, features; utils.warm_up(); features.warm_up()" (见 .devcontainer)，
+    numba 的磁盘缓存就已经填好，这里只剩导入与加载缓存的开销。
+    """
+    thread = threading.Thread(target=_warm_up, name="voiceice-warmup", daemon=True)
+    thread.start()
+    return thread
+
+if WARMUP:
+    start_warm_up()
+
+def purge_derived(audio_hash):
+    """
+    某段音频已从金库真正删除 (删除最后一个名字，或同名上传覆盖了旧内容) 后，
+    清理由它派生的一切：解码缓存、特征、落盘的渲染与播放文件，以及内存里的渲染 / 可视化 / 播放缓存。
+    audio_hash 为 None (音频块仍被其它名字引用) 时什么也不做。
+    """
+    if audio_hash is None:
+        return
+    get_pcm_cache().discard(audio_hash)
+    get_preview_pcm_cache().discard(audio_hash)
+    get_feature_store().discard(audio_hash)
+    for render_path in glob.glob(os.path.join(RENDER_DIR, f"{audio_hash}_*.npy")):
+        os.remove(render_path)
+    for blob_path in glob.glob(os.path.join(PLAYBACK_DIR, f"{audio_hash}_*")):
+        os.remove(blob_path)
+    for memory_cache in (get_render_cache(), get_artifact_cache(), get_playback_cache()):
+        memory_cache.discard_matching(lambda key: audio_hash in key)
+
 # --- 核心状态机初始化与本地数据恢复 ---
-if 'audio_vault' not in st.session_state:
-    st.session_state['audio_vault'] = {}
-    
-    # 开机自检：遍历本地文件夹，将历史遗留的音频流全部加载回内存
-    for filename in os.listdir(VAULT_DIR):
-        file_path = os.path.join(VAULT_DIR, filename)
-        if os.path.isfile(file_path):
-            with open(file_path, "rb") as f:
-                st.session_state['audio_vault'][filename] = f.read()
+# 开机自检：只加载金库索引 (文件名、指纹、时长、采样率)，不读取任何音频内容
+audio_vault = get_vault_store()
+if 'vault_synced' not in st.session_state:
+    # 每个新会话开始时做一次轻量扫描，收编被直接拷进金库目录的新文件
+    audio_vault.sync()
+    st.session_state['vault_synced'] = True
 # 2. 初始化 
-if 'audio_vault' not in st.session_state:
-    # 核心金库：{"文件名": 纯二进制数据}
-    st.session_state['audio_vault'] = {}
 if 'current_target' not in st.session_state:
     # 当前系统聚焦的目标文件名
     st.session_state['current_target'] = None
@@ -67,13 +483,9 @@ if recorded_audio_bytes is not None and recorded_audio_bytes != st.session_state
     time_str = datetime.datetime.now().strftime("%H_%M_%S") # 避免文件名中出现操作系统不允许的冒号
     new_name = f"即兴心声_{time_str}.wav"
     
-    # 1. 存入内存金库
-    st.session_state['audio_vault'][new_name] = recorded_audio_bytes
+    # 存入共享金库 (按内容去重、原子落盘)；同名条目原来的内容被释放时一并清理派生缓存
+    purge_derived(audio_vault.add(new_name, recorded_audio_bytes))
     st.session_state['current_target'] = new_name
-    
-    # 2. 物理落盘备份
-    with open(os.path.join(VAULT_DIR, new_name), "wb") as f:
-        f.write(recorded_audio_bytes)
 
 # 场景B：检测到新的上传文件
 elif uploaded_file is not None:
@@ -84,15 +496,12 @@ elif uploaded_file is not None:
         
         raw_bytes = uploaded_file.getvalue()
         
-        # 1. 存入内存金库
-        st.session_state['audio_vault'][new_name] = raw_bytes
+        # 存入共享金库 (按内容去重、原子落盘)；同名条目原来的内容被释放时一并清理派生缓存
+        purge_derived(audio_vault.add(new_name, raw_bytes))
         st.session_state['current_target'] = new_name
-        
-        # 2. 物理落盘备份
-        with open(os.path.join(VAULT_DIR, new_name), "wb") as f:
-            f.write(raw_bytes)
 # 4. 渲染侧边栏的历史记录组件 
-selected_history, delete_triggered, files_to_delete = ui_components.render_sidebar_history()
+selected_history, delete_triggered, files_to_delete = ui_components.render_sidebar_history(audio_vault)
+playback_format, playback_quality = ui_components.render_sidebar_playback()
 
 # 补充场景：如果用户点击了历史记录按钮，切换游标
 if selected_history is not None:
@@ -100,18 +509,12 @@ if selected_history is not None:
     
 if delete_triggered and files_to_delete:
     for name in files_to_delete:
-        # 1. 内存释放
-        if name in st.session_state['audio_vault']:
-            del st.session_state['audio_vault'][name]
-        
-        # 2. 游标安全校验
+        # 1. 游标安全校验
         if st.session_state['current_target'] == name:
             st.session_state['current_target'] = None
             
-        # 3. 硬盘物理抹除
-        file_path = os.path.join(VAULT_DIR, name)
-        if os.path.exists(file_path):
-            os.remove(file_path) # 调用系统接口删除文件
+        # 2. 索引除名；音频块只有在不再被任何名字引用时才会从硬盘抹除，连同它的全部派生缓存
+        purge_derived(audio_vault.remove(name))
     
     st.rerun()
 
@@ -119,26 +522,74 @@ if delete_triggered and files_to_delete:
 ui_components.render_header()
 target_name = st.session_state.get('current_target')
 
-if target_name and target_name in st.session_state['audio_vault']:
+if target_name and target_name in audio_vault:
     try:
-        # 1. 拿到纯净的二进制数据
-        raw_bytes = st.session_state['audio_vault'][target_name]
+        # 1. 从索引拿到内容指纹 (二进制数据此时还留在磁盘上)
+        audio_hash = audio_vault.get(target_name)["hash"]
         
         # 2. 调用缓存函数！
-        # 只要你还在处理同一个音频 (raw_bytes 没变)，滑动温度条时这里将瞬间执行完毕，耗时几乎为 0 毫秒！
-        y, sr = load_audio_from_bytes(raw_bytes)
+        # 只要你还在处理同一个音频 (指纹没变)，滑动温度条时这里将瞬间执行完毕，耗时几乎为 0 毫秒！
+        # 只有缓存未命中时才会真正去磁盘读取这个条目的二进制数据
+        with metrics.span("load_audio"):
+            y, sr = load_audio_from_bytes(audio_hash, lambda: audio_vault.read_bytes(target_name))
         
         st.markdown(f"**当前聆听:** `{target_name}`")
         
         # 3. 实时渲染控制区
-        temperature = ui_components.render_controls()
-        
-        # 4. DSP 引擎处理 (这部分是纯内存 NumPy 矩阵运算，非常快，不需要缓存)
-        y_processed = utils.process_audio_speed_and_pitch(y, temperature, sr)
+        temperature, tier = ui_components.render_controls()
         
-        ui_components.render_tabs_content(y, y_processed, sr, temperature)
+        # 4. DSP 引擎处理 (先渲染当前温度，首次选中时其余档位在后台逐个预渲染，之后按 内容指纹+温度+质量档位 查共享缓存)
+        #    试听档位在降采样副本上处理，精修档位使用原始采样率
+        y_tier, sr_tier = load_tier_source(audio_hash, tier, y, sr)
+        y_processed, shown_temperature, render_pending = render_processed(y_tier, sr_tier, temperature, audio_hash, tier)
+        prerender_temperature_grid(y_tier, sr_tier, audio_hash, tier, temperature)
+        if y_processed is None or (shown_temperature != cache.quantize_temperature(temperature)
+                                   and is_long_audio(y_tier, sr_tier)):
+            # 长录音流式渲染中：显示进度，开头写好后先放出来试听 (下方仍显示最近一次完成的结果，如果有)
+            ui_components.render_partial_preview(
+                temperature, get_partial_preview(audio_hash, temperature, tier, sr_tier, playback_format, playback_quality), sr_tier)
+        elif shown_temperature != cache.quantize_temperature(temperature):
+            st.caption(f"🔄 火候 {temperature:.1f} 正在后台渲染，暂时显示 {shown_temperature:.1f} 的结果")
+
+        if y_processed is not None:
+            # 原始一侧始终展示原始采样率；处理后一侧展示当前档位的结果
+            spectrograms = (
+                get_spectrogram_pyramid(y, sr, audio_hash, 1.0, "final"),
+                get_spectrogram_pyramid(y_processed, sr_tier, audio_hash, shown_temperature, tier),
+            )
+            waveforms = (
+                get_waveform_pyramid(y, sr, audio_hash, 1.0, "final"),
+                get_waveform_pyramid(y_processed, sr_tier, audio_hash, shown_temperature, tier),
+            )
+            playback = (
+                get_playback_blob(y, sr, audio_hash, 1.0, "final", playback_format, playback_quality),
+                get_playback_blob(y_processed, sr_tier, audio_hash, shown_temperature, tier, playback_format, playback_quality),
+            )
+            # 特征在解语手札的局部片段里读取，后台计算期间只有那一块定时刷新
+            def get_analysis():
+                return get_features(y, sr, y_processed, sr_tier, audio_hash, shown_temperature)
+            # 导出始终用无损 FLAC，与播放格式无关 (播放格式本身是 FLAC 时与播放数据共用同一个缓存键)
+            export = None
+            if tier == "final" and not render_pending:
+                export = (
+                    get_playback_blob(y_processed, sr_tier, audio_hash, shown_temperature, tier, "FLAC", playback_quality),
+                    f"{os.path.splitext(target_name)[0]}_t{shown_temperature:.1f}",
+                )
+            ui_components.render_tabs_content(shown_temperature, spectrograms, waveforms, playback, get_analysis, export,
+                                              poll_seconds=RENDER_POLL_SECONDS)
         
     except Exception as e:
         st.error(f"处理音频时遇到干扰: {e}")
 else:
-    st.info("👈 请在左侧拾遗冰窖上传文件，或点击麦克风录制现场心声。")
\ No newline at end of file
+    st.info("👈 请在左侧拾遗冰窖上传文件，或点击麦克风录制现场心声。")
+
+# 6. 调试面板：只有打开埋点 (VOICEICE_METRICS=1) 时才显示
+if metrics.is_enabled():
+    ui_components.render_debug_panel(metrics.REGISTRY)
+
+# 7. 后台还有渲染任务时稍后自动重跑，把新结果换上来 (用户先动了滑块的话，这次重跑会被新的交互取代)
+#    特征任务不在这里轮询，由解语手札自己的局部片段定时刷新
+render_slot = st.session_state.get('render_slot')
+if render_slot is not None and render_slot.busy:
+    time.sleep(RENDER_POLL_SECONDS)
+    st.rerun()
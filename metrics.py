@@ -0,0 +1,288 @@
+# metrics.py
+"""
+轻量的分阶段计时 / 内存埋点。
+
+    with metrics.span("decode"):
+        ...
+
+    @metrics.timed("lowpass")
+    def apply_lowpass_filter(...):
+        ...
+
+- 默认关闭：span() 直接返回一个共享的空上下文，timed() 包装的函数只多一次布尔判断
+- 打开方式：环境变量 VOICEICE_METRICS=1，或在代码里调用 metrics.enable()
+- VOICEICE_METRICS_MEMORY=1 时额外开启 tracemalloc，记录每个阶段的峰值内存
+  (tracemalloc 本身会让分配变慢，只建议排查问题时打开)。
+  tracemalloc 的峰值是全进程共享的，同一时刻只有一个线程的 span 记录内存 (最先进入的那个，
+  直到它最外层的 span 结束)，其它线程的 span 只计时；记录到的峰值也包含同期其它线程的分配，
+  只有这段时间里基本只有这一个线程在分配内存时才有参考意义
+- 每个阶段保留最近 WINDOW 次的耗时做滚动统计 (p50/p95/max)，
+  同时按固定桶累计 Prometheus 直方图；可导出 JSON 或 Prometheus 文本，
+  设置 VOICEICE_METRICS_PORT 时由 serve() 在后台线程里提供 /metrics 与 /metrics.json
+"""
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+# 每个阶段保留的滚动样本数
+WINDOW = 512
+# Prometheus 直方图的桶上界 (秒)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Stage:
+    """单个阶段的统计：滚动窗口 + 累计直方图"""
+
+    __slots__ = ("recent", "peaks", "count", "total", "bucket_counts", "last")
+
+    def __init__(self):
+        self.recent = deque(maxlen=WINDOW)
+        self.peaks = deque(maxlen=WINDOW)
+        self.count = 0
+        self.total = 0.0
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.last = None
+
+    def observe(self, seconds: float, peak_bytes):
+        self.recent.append(seconds)
+        if peak_bytes is not None:
+            self.peaks.append(peak_bytes)
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def summary(self) -> dict:
+        ordered = sorted(self.recent)
+
+        def _pct(q):
+            return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else None
+
+        return {
+            "count": self.count,
+            "total_seconds": round(self.total, 6),
+            "last_ms": round(self.last * 1000, 3) if self.last is not None else None,
+            "p50_ms": round(_pct(0.5) * 1000, 3) if ordered else None,
+            "p95_ms": round(_pct(0.95) * 1000, 3) if ordered else None,
+            "max_ms": round(ordered[-1] * 1000, 3) if ordered else None,
+            "peak_mb": round(max(self.peaks) / 2 ** 20, 3) if self.peaks else None,
+        }
+
+
+class MetricsRegistry:
+    """全进程共享的阶段统计表，Streamlit 的多个会话线程会同时写入，因此加锁"""
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_memory = False
+        self._stages = {}
+        self._lock = threading.Lock()
+        # 每个线程一条 span 栈，用来把内层阶段的内存峰值传递给外层
+        self._local = threading.local()
+        # 当前独占内存追踪的线程 (reset_peak 是全进程的，两个线程交替重置会互相抹掉峰值)
+        self._memory_owner = None
+
+    def observe(self, name: str, seconds: float, peak_bytes=None):
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = self._stages[name] = _Stage()
+            stage.observe(seconds, peak_bytes)
+
+    def snapshot(self) -> dict:
+        """{阶段名: 统计摘要}，按累计耗时从高到低排列"""
+        with self._lock:
+            items = [(name, stage.summary()) for name, stage in self._stages.items()]
+        items.sort(key=lambda item: item[1]["total_seconds"], reverse=True)
+        return dict(items)
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+    def _stack(self) -> list:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _claim_memory(self) -> bool:
+        """当前线程是否可以记录内存峰值：没有线程占用时占用它"""
+        with self._lock:
+            if self._memory_owner is None:
+                self._memory_owner = threading.get_ident()
+            return self._memory_owner == threading.get_ident()
+
+    def _release_memory(self):
+        with self._lock:
+            self._memory_owner = None
+
+    def to_json(self) -> str:
+        return json.dumps({"enabled": self.enabled, "stages": self.snapshot()}, ensure_ascii=False, indent=1)
+
+    def to_prometheus(self) -> str:
+        """Prometheus 文本格式：每个阶段一组 voiceice_stage_seconds 直方图"""
+        with self._lock:
+            stages = {name: (list(s.bucket_counts), s.count, s.total, max(s.peaks) if s.peaks else None)
+                      for name, s in self._stages.items()}
+        lines = [
+            "# HELP voiceice_stage_seconds Wall time spent in each processing stage.",
+            "# TYPE voiceice_stage_seconds histogram",
+        ]
+        for name, (bucket_counts, count, total, _) in sorted(stages.items()):
+            cumulative = 0
+            for bound, n in zip(BUCKETS, bucket_counts):
+                cumulative += n
+                lines.append(f'voiceice_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'voiceice_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {count}')
+            lines.append(f'voiceice_stage_seconds_sum{{stage="{name}"}} {total:.6f}')
+            lines.append(f'voiceice_stage_seconds_count{{stage="{name}"}} {count}')
+        peaks = [(name, peak) for name, (_, _, _, peak) in sorted(stages.items()) if peak is not None]
+        if peaks:
+            lines.append("# HELP voiceice_stage_peak_bytes Largest traced allocation peak within a stage (rolling window).")
+            lines.append("# TYPE voiceice_stage_peak_bytes gauge")
+            lines.extend(f'voiceice_stage_peak_bytes{{stage="{name}"}} {peak}' for name, peak in peaks)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class _Span:
+    """
+    一次计时区间；开启内存追踪时同时记录区间内的分配峰值 (相对于进入时的占用)。
+    其它线程正在记录内存时只计时，peak 留空
+    """
+
+    __slots__ = ("name", "start", "base", "child_peak")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        if REGISTRY.trace_memory and tracemalloc.is_tracing() and REGISTRY._claim_memory():
+            stack = REGISTRY._stack()
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                # 重置峰值前先把目前为止的峰值交给外层阶段保管
+                stack[-1].child_peak = max(stack[-1].child_peak, peak)
+            tracemalloc.reset_peak()
+            self.base = current
+            self.child_peak = current
+            stack.append(self)
+        else:
+            self.base = None
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        peak_bytes = None
+        if self.base is not None:
+            stack = REGISTRY._stack()
+            peak = max(tracemalloc.get_traced_memory()[1], self.child_peak)
+            peak_bytes = peak - self.base
+            stack.pop()
+            if stack:
+                stack[-1].child_peak = max(stack[-1].child_peak, peak)
+            else:
+                REGISTRY._release_memory()
+        REGISTRY.observe(self.name, seconds, peak_bytes)
+        return False
+
+
+class _NoopSpan:
+    """关闭状态下使用的空上下文，所有 span() 调用共享同一个实例"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str):
+    """计时上下文：with metrics.span("stft"): ..."""
+    return _Span(name) if REGISTRY.enabled else _NOOP
+
+
+def timed(name: str = None):
+    """计时装饰器；不给名字时使用函数名"""
+    def decorator(fn):
+        stage = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not REGISTRY.enabled:
+                return fn(*args, **kwargs)
+            with _Span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def enable(trace_memory: bool = False):
+    REGISTRY.enabled = True
+    REGISTRY.trace_memory = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    REGISTRY.enabled = False
+    if REGISTRY.trace_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    REGISTRY.trace_memory = False
+
+
+def is_enabled() -> bool:
+    return REGISTRY.enabled
+
+
+def serve(port: int, host: str = "0.0.0.0"):
+    """
+    在后台线程里启动一个只读 HTTP 服务：/metrics 返回 Prometheus 文本，/metrics.json 返回 JSON。
+    返回服务对象，调用方负责保证同一端口只启动一次 (main.py 用 @st.cache_resource 托管)。
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith("/metrics.json"):
+                body, content_type = REGISTRY.to_json(), "application/json; charset=utf-8"
+            elif self.path.startswith("/metrics"):
+                body, content_type = REGISTRY.to_prometheus(), "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                self.send_error(404)
+                return
+            payload = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            # 抓取请求很频繁，不往控制台刷日志
+            pass
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="voiceice-metrics", daemon=True).start()
+    return server
+
+
+# 由环境变量决定启动时是否打开埋点
+if os.environ.get("VOICEICE_METRICS", "0") not in ("", "0"):
+    enable(trace_memory=os.environ.get("VOICEICE_METRICS_MEMORY", "0") not in ("", "0"))
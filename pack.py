@@ -0,0 +1,161 @@
+# pack.py
+import io
+import json
+import os
+import threading
+
+import cache
+
+# 索引文件名；打包文件本身按代次命名 (pack-<代次>.bin)，整理 (compact) 时换成新的一代
+INDEX_NAME = "index.json"
+
+
+class _PackSlice(io.RawIOBase):
+    """
+    打包文件里某一条记录的只读视图，表现得像一个独立的文件 (支持 seek / tell / read)，
+    可以直接交给 soundfile 打开，按需读取其中任意一段，不必先把整条记录读进内存。
+    """
+
+    def __init__(self, file_path: str, offset: int, length: int):
+        self._f = open(file_path, "rb")
+        self._offset = offset
+        self._length = length
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self._pos
+        elif whence == io.SEEK_END:
+            pos += self._length
+        self._pos = min(max(pos, 0), self._length)
+        return self._pos
+
+    def readinto(self, buffer):
+        n = min(len(buffer), self._length - self._pos)
+        if n <= 0:
+            return 0
+        self._f.seek(self._offset + self._pos)
+        n = self._f.readinto(memoryview(buffer)[:n])
+        self._pos += n
+        return n
+
+    def close(self):
+        self._f.close()
+        super().close()
+
+
+class PackFile:
+    """
+    只追加的打包文件 + 偏移索引，把大量小文件合并成一个大文件存放。
+
+    磁盘布局：
+        <目录>/pack-<代次>.bin    所有记录首尾相接，只在末尾追加
+        <目录>/index.json         {"pack": 当前打包文件名, "entries": {键: {offset, length}}}
+
+    - 先追加数据并落盘，再原子改写索引：中途崩溃最多在末尾留下一段没有索引指向的垃圾
+    - 删除只从索引里除名，空间由 compact() 统一回收：把仍然有效的记录写进新一代打包文件，
+      再原子切换索引，旧文件最后才删除，任何时刻索引都指向一个完整的打包文件
+    - 目录在第一次写入时才创建，只读打开 (例如没有启用打包的金库) 不会在磁盘上留下空目录
+    """
+
+    def __init__(self, pack_dir: str):
+        self.pack_dir = pack_dir
+        self.index_path = os.path.join(pack_dir, INDEX_NAME)
+        self._lock = threading.Lock()
+        self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        self.pack_name = index.get("pack", "pack-0.bin")
+        size = os.path.getsize(self.pack_path) if os.path.exists(self.pack_path) else 0
+        # 超出文件末尾的记录 (打包文件被截断) 视为不存在
+        self._entries = {
+            key: entry for key, entry in index.get("entries", {}).items()
+            if entry["offset"] + entry["length"] <= size
+        }
+
+    def _save_index(self):
+        payload = json.dumps({"pack": self.pack_name, "entries": self._entries}, indent=1).encode("utf-8")
+        cache.atomic_write(self.index_path, payload)
+
+    @property
+    def pack_path(self) -> str:
+        return os.path.join(self.pack_dir, self.pack_name)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def append(self, key: str, data: bytes):
+        """在打包文件末尾追加一条记录；同一个键再次写入时，旧数据变成等待回收的垃圾"""
+        with self._lock:
+            os.makedirs(self.pack_dir, exist_ok=True)
+            with open(self.pack_path, "ab") as f:
+                offset = f.seek(0, io.SEEK_END)
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self._entries[key] = {"offset": offset, "length": len(data)}
+            self._save_index()
+
+    def read(self, key: str) -> bytes:
+        """读出一整条记录；键不存在时抛出 KeyError"""
+        with self._open(key) as f:
+            return f.read()
+
+    def open(self, key: str) -> _PackSlice:
+        """以只读文件对象的形式打开一条记录，调用方负责 close (或用 with)"""
+        return self._open(key)
+
+    def _open(self, key: str) -> _PackSlice:
+        with self._lock:
+            entry = self._entries[key]
+            # 在锁内打开：compact() 切换到新一代文件之后，已经打开的旧文件句柄仍然可读
+            return _PackSlice(self.pack_path, entry["offset"], entry["length"])
+
+    def remove(self, key: str):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._save_index()
+
+    @property
+    def garbage_bytes(self) -> int:
+        """打包文件里已经没有索引指向的字节数"""
+        with self._lock:
+            size = os.path.getsize(self.pack_path) if os.path.exists(self.pack_path) else 0
+            return size - sum(entry["length"] for entry in self._entries.values())
+
+    def compact(self):
+        """把仍然有效的记录依次复制到新一代打包文件，回收被删除记录占用的空间"""
+        with self._lock:
+            old_path = self.pack_path
+            generation = int(self.pack_name[len("pack-"):-len(".bin")]) + 1
+            new_name = f"pack-{generation}.bin"
+            entries = {}
+            os.makedirs(self.pack_dir, exist_ok=True)
+            with open(os.path.join(self.pack_dir, new_name), "wb") as dst:
+                if os.path.exists(old_path):
+                    with open(old_path, "rb") as src:
+                        for key, entry in sorted(self._entries.items(), key=lambda item: item[1]["offset"]):
+                            src.seek(entry["offset"])
+                            entries[key] = {"offset": dst.tell(), "length": entry["length"]}
+                            dst.write(src.read(entry["length"]))
+                dst.flush()
+                os.fsync(dst.fileno())
+            self.pack_name, self._entries = new_name, entries
+            self._save_index()
+            if os.path.exists(old_path):
+                os.remove(old_path)
@@ -0,0 +1,598 @@
+# streaming.py
+import functools
+import os
+
+import numpy as np
+import soundfile as sf
+
+import metrics
+import utils
+import worker
+
+# ==========================================
+# 【流式处理引擎】 - 按块读入、按块输出，峰值内存只取决于块大小，与录音时长无关
+# 每一级都与 utils.process_audio_speed_and_pitch 的整块算法逐级对应：
+#   STFT → 相位声码器 → ISTFT (utils.stretch_and_shift 的变速部分)
+#   → 重采样 (变调) → 零相位低通 / 饱和失真
+# ==========================================
+
+
+def _concat(parts, dtype):
+    """拼接若干小块；全为空时返回一个空数组"""
+    parts = [p for p in parts if len(p)]
+    if not parts:
+        return np.zeros(0, dtype=dtype)
+    return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+class _StreamingStretcher:
+    """
+    librosa.stft → librosa.phase_vocoder → librosa.istft 的流式等价实现。
+
+    分析端：与 librosa.stft(center=True) 一样在开头补 n_fft//2 个零，每凑够一帧就做一次 FFT；
+    声码器：与 librosa.phase_vocoder 的逐帧插值、相位累加完全相同，只是拿到后一帧就立刻输出；
+    合成端：重叠相加 (overlap-add)，某个采样点之后不会再有新帧覆盖时，就除以窗函数能量后输出。
+    """
+
+    def __init__(self, rate: float, n_fft: int = 2048, hop_length: int = None, dtype=np.float32):
+        self.rate = float(rate)
+        self.n_fft = n_fft
+        self.hop = hop_length or n_fft // 4
+        self.dtype = np.dtype(dtype)
+
+        from scipy import signal
+        self.window = signal.get_window("hann", n_fft, fftbins=True)
+        self.window_sq = (self.window ** 2).astype(self.dtype)
+        self.phi_advance = self.hop * np.linspace(0, np.pi, 1 + n_fft // 2)
+
+        # 分析端状态：_in_buf[0] 对应"补零后信号"中的 _in_base 位置
+        self._in_buf = np.zeros(n_fft // 2, dtype=self.dtype)
+        self._in_base = 0
+        self._n_in = 0
+        self._frames = {}          # 帧序号 → 复数频谱列 (只保留声码器还会用到的帧)
+        self._n_frames = 0
+
+        # 声码器状态
+        self._step = 0
+        self._phase_acc = None
+
+        # 合成端状态：_ola[0] 对应"补零后输出"中的 _ola_base 位置
+        self._ola = np.zeros(0, dtype=self.dtype)
+        self._wss = np.zeros(0, dtype=self.dtype)
+        self._ola_base = 0
+        self._n_out = 0
+
+    @property
+    def latency(self) -> int:
+        """算法延迟 (以输入采样点计)：至少要攒够一整帧再加一个跳步才能输出"""
+        return self.n_fft + self.hop
+
+    def _analyze(self, final: bool):
+        """把输入缓冲区里已经凑齐的帧都做 FFT"""
+        # 输入结束时 librosa.stft 的总帧数为 1 + len(y) // hop
+        n_total = 1 + self._n_in // self.hop if final else None
+        while True:
+            start = self._n_frames * self.hop - self._in_base
+            if final:
+                if self._n_frames >= n_total:
+                    break
+                frame = self._in_buf[start:start + self.n_fft]
+                frame = np.pad(frame, (0, self.n_fft - len(frame)))
+            else:
+                if start + self.n_fft > len(self._in_buf):
+                    break
+                frame = self._in_buf[start:start + self.n_fft]
+            self._frames[self._n_frames] = np.fft.rfft(self.window * frame).astype(np.complex64)
+            self._n_frames += 1
+
+        # 丢弃以后不会再用到的输入
+        drop = self._n_frames * self.hop - self._in_base
+        if drop > 0:
+            self._in_buf = self._in_buf[drop:]
+            self._in_base += drop
+
+    def _vocode(self, final: bool) -> list:
+        """按 librosa.phase_vocoder 的算法产出所有已经具备条件的输出帧"""
+        columns = []
+        zero = np.zeros(1 + self.n_fft // 2, dtype=np.complex64)
+        while True:
+            step = self._step * self.rate
+            index = int(step)
+            if final:
+                if step >= self._n_frames:
+                    break
+            elif index + 1 >= self._n_frames:
+                break
+
+            col0 = self._frames.get(index, zero)
+            col1 = self._frames.get(index + 1, zero)
+            if self._phase_acc is None:
+                self._phase_acc = np.angle(col0)
+
+            alpha = np.mod(step, 1.0)
+            mag = (1.0 - alpha) * np.abs(col0) + alpha * np.abs(col1)
+            columns.append((mag * np.exp(1j * self._phase_acc)).astype(np.complex64))
+
+            dphase = np.angle(col1) - np.angle(col0) - self.phi_advance
+            dphase = dphase - 2.0 * np.pi * np.round(dphase / (2.0 * np.pi))
+            self._phase_acc += self.phi_advance + dphase
+            self._step += 1
+
+        # 声码器只会往后看，早于当前插值位置的帧可以释放
+        keep_from = int(self._step * self.rate)
+        for old in [k for k in self._frames if k < keep_from]:
+            del self._frames[old]
+        return columns
+
+    def _synthesize(self, columns: list, final: bool) -> np.ndarray:
+        """重叠相加；返回所有已经"定稿"的输出采样 (已扣除开头 n_fft//2 的补零)"""
+        k0 = self._step - len(columns)
+        if columns:
+            end = (self._step - 1) * self.hop + self.n_fft - self._ola_base
+            if end > len(self._ola):
+                grow = end - len(self._ola)
+                self._ola = np.concatenate([self._ola, np.zeros(grow, dtype=self.dtype)])
+                self._wss = np.concatenate([self._wss, np.zeros(grow, dtype=self.dtype)])
+            frames = np.fft.irfft(np.stack(columns, axis=1), n=self.n_fft, axis=0) * self.window[:, None]
+            for i in range(len(columns)):
+                pos = (k0 + i) * self.hop - self._ola_base
+                self._ola[pos:pos + self.n_fft] += frames[:, i]
+                self._wss[pos:pos + self.n_fft] += self.window_sq
+
+        # 下一帧从 _step * hop 开始，此前的位置都不会再变化；输入结束时全部定稿
+        ready = len(self._ola) if final else self._step * self.hop - self._ola_base
+        ready = max(0, min(ready, len(self._ola)))
+        out = self._ola[:ready].copy()
+        wss = self._wss[:ready]
+        nonzero = wss > np.finfo(self.dtype).tiny
+        out[nonzero] /= wss[nonzero]
+        self._ola = self._ola[ready:]
+        self._wss = self._wss[ready:]
+
+        # 与 istft(center=True) 一样去掉开头 n_fft//2 个补零位置
+        head = max(0, self.n_fft // 2 - self._ola_base)
+        self._ola_base += ready
+        return out[head:]
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        block = np.asarray(block, dtype=self.dtype)
+        self._in_buf = np.concatenate([self._in_buf, block])
+        self._n_in += len(block)
+        self._analyze(final=False)
+        out = self._synthesize(self._vocode(final=False), final=False)
+        return self._clip_length(out, int(round(self._n_in / self.rate)))
+
+    def flush(self) -> np.ndarray:
+        self._analyze(final=True)
+        out = self._synthesize(self._vocode(final=True), final=True)
+        # 与 istft(length=...) 一样截断或补零到 round(len(y) / rate)
+        target = int(round(self._n_in / self.rate))
+        out = self._clip_length(out, target)
+        missing = target - self._n_out
+        if missing > 0:
+            self._n_out += missing
+            out = np.concatenate([out, np.zeros(missing, dtype=self.dtype)])
+        return out
+
+    def _clip_length(self, out: np.ndarray, limit: int) -> np.ndarray:
+        out = out[:max(0, limit - self._n_out)]
+        self._n_out += len(out)
+        return out
+
+
+class _StreamingResampler:
+    """对 soxr 流式重采样的薄封装，并与 utils.stretch_and_shift 一样把总长度对齐到 target"""
+
+    def __init__(self, in_rate: float, out_rate: float, dtype=np.float32):
+        self.dtype = np.dtype(dtype)
+        self.ratio = out_rate / in_rate
+        import soxr
+        self._stream = soxr.ResampleStream(in_rate, out_rate, 1, dtype=self.dtype.name, quality="HQ")
+        self._n_out = 0
+
+    def process(self, block: np.ndarray, limit: int, last: bool = False) -> np.ndarray:
+        out = self._stream.resample_chunk(np.asarray(block, dtype=self.dtype), last=last)
+        out = out[:max(0, limit - self._n_out)]
+        self._n_out += len(out)
+        return out
+
+    def flush(self, target: int) -> np.ndarray:
+        out = self.process(np.zeros(0, dtype=self.dtype), target, last=True)
+        missing = target - self._n_out
+        if missing > 0:
+            self._n_out += missing
+            out = np.concatenate([out, np.zeros(missing, dtype=self.dtype)])
+        return out
+
+
+class _StreamingLowpass:
+    """
+    分块版零相位低通 (sosfiltfilt)。
+
+    零相位滤波需要看到"未来"的采样才能做反向滤波，因此这里保留 lookahead 个采样的前瞻，
+    并在每个窗口左侧带上同样长度的历史作为热身：IIR 的冲激响应在几百个采样内就衰减到
+    浮点噪声以下，所以窗口中间部分与整段 filtfilt 的结果一致，两端的边界效应被裁掉。
+    """
+
+    def __init__(self, sos, lookahead: int = 1024, dtype=np.float32):
+        from scipy import signal
+        self._sosfiltfilt = signal.sosfiltfilt
+        self.sos = sos
+        self.lookahead = lookahead
+        self.dtype = np.dtype(dtype)
+        self._hist = np.zeros(0, dtype=self.dtype)
+        self._left = 0  # _hist 开头有多少个采样只是热身用的历史
+
+    def _filtfilt(self, x):
+        # 与 sosfiltfilt 的默认边界延拓长度相同，信号太短时退化为 len(x) - 1
+        padlen = min(3 * (2 * len(self.sos) + 1), len(x) - 1)
+        return self._sosfiltfilt(self.sos, x, padlen=padlen).astype(self.dtype, copy=False)
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        self._hist = np.concatenate([self._hist, np.asarray(block, dtype=self.dtype)])
+        ready = len(self._hist) - self._left - self.lookahead
+        if ready <= 0:
+            return np.zeros(0, dtype=self.dtype)
+        filtered = self._filtfilt(self._hist)
+        out = filtered[self._left:self._left + ready]
+        # 保留下一窗口需要的历史 (最多 lookahead 个) 与尚未输出的前瞻部分
+        new_left = min(self.lookahead, self._left + ready)
+        self._hist = self._hist[self._left + ready - new_left:]
+        self._left = new_left
+        return out
+
+    def flush(self) -> np.ndarray:
+        if len(self._hist) - self._left <= 0:
+            return np.zeros(0, dtype=self.dtype)
+        if len(self._hist) < 2:
+            return self._hist[self._left:].copy()
+        return self._filtfilt(self._hist)[self._left:]
+
+
+class TemperatureStream:
+    """
+    按温度处理音频的流式管线：process(block) 送入任意长度的一块，返回当前已经能确定的输出；
+    全部送完后调用 flush() 取回尾部。所有输出拼起来与
+    utils.process_audio_speed_and_pitch 的整块结果在数值误差范围内一致。
+    """
+
+    def __init__(self, sr: int, temperature: float, n_fft: int = 2048, hop_length: int = None,
+                 dtype=np.float32):
+        self.sr = sr
+        self.temperature = temperature
+        self.dtype = np.dtype(dtype)
+
+        self.rate, self.n_steps = utils._temperature_params(temperature)
+        self.pitch_rate = 2.0 ** (-float(self.n_steps) / 12)
+        self._n_in = 0
+
+        self._stretcher = None
+        self._resampler = None
+        if self.rate != 1.0 or self.n_steps != 0.0:
+            self._stretcher = _StreamingStretcher(self.rate * self.pitch_rate, n_fft, hop_length, self.dtype)
+            if self.n_steps != 0.0:
+                self._resampler = _StreamingResampler(float(sr) / self.pitch_rate, sr, self.dtype)
+
+        cutoff, self.gain, self.drive = utils._tone_params(temperature)
+        self._lowpass = None
+        if cutoff is not None:
+            self._lowpass = _StreamingLowpass(utils._design_lowpass(sr, float(cutoff), self.dtype), dtype=self.dtype)
+
+    def _tone(self, block: np.ndarray) -> np.ndarray:
+        if self.gain != 1.0:
+            block = block * self.gain
+        if self.drive is not None:
+            block = utils.apply_saturation(block, self.drive)
+        return block.astype(self.dtype, copy=False)
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        block = np.asarray(block, dtype=self.dtype)
+        self._n_in += len(block)
+        if self.temperature == 1.0:
+            return block
+
+        current = block
+        if self._stretcher is not None:
+            current = self._stretcher.process(current)
+            if self._resampler is not None:
+                current = self._resampler.process(current, int(round(self._n_in / self.rate)))
+        if self._lowpass is not None:
+            current = self._lowpass.process(current)
+        return self._tone(current)
+
+    def flush(self) -> np.ndarray:
+        if self.temperature == 1.0:
+            return np.zeros(0, dtype=self.dtype)
+
+        target = int(round(self._n_in / self.rate))
+        if self._stretcher is not None:
+            tail = self._stretcher.flush()
+            if self._resampler is not None:
+                tail = _concat([self._resampler.process(tail, target), self._resampler.flush(target)], self.dtype)
+        else:
+            tail = np.zeros(0, dtype=self.dtype)
+        if self._lowpass is not None:
+            tail = _concat([self._lowpass.process(tail), self._lowpass.flush()], self.dtype)
+        return self._tone(tail)
+
+    def output_length(self, n_input: int) -> int:
+        """输入总长为 n_input 时的输出总长 (与整块处理一致)"""
+        return n_input if self.temperature == 1.0 else int(round(n_input / self.rate))
+
+
+
+@functools.lru_cache(maxsize=256)
+def _measure_latency(sr: int, temperature: float, frame_size: int, n_fft: int, hop_length, dtype,
+                     history_len: int) -> int:
+    """
+    用静音空跑一遍同样配置的管线 (连同整帧输出的等待)，统计"已送入但对应输出还没返回"的最大积压，
+    折算成输入采样。输出数量只取决于输入长度，与内容无关，所以空跑得到的就是实际的延迟。
+    空跑要几十毫秒，远超一帧的时间预算，所以按 (配置, 量化温度) 缓存，同一组参数只测一次。
+    """
+    probe = TemperatureStream(sr, temperature, n_fft=n_fft, hop_length=hop_length, dtype=dtype)
+    if probe.temperature == 1.0:
+        # 原样输出，每帧当场返回
+        return 0
+    zeros = np.zeros(frame_size, dtype=dtype)
+    # 跑过足够多个 STFT / 滤波器周期，让积压进入稳态
+    n_frames = max(64, 16 * (n_fft + history_len) // frame_size)
+    n_in = n_out = 0
+    worst = 0.0
+    for _ in range(n_frames):
+        n_out += len(probe.process(zeros))
+        n_in += frame_size
+        emitted = n_out // frame_size * frame_size
+        worst = max(worst, n_in - emitted * probe.rate)
+    return int(np.ceil(worst))
+
+
+class StreamingProcessor:
+    """
+    面向实时输入 (例如麦克风) 的有状态流式处理器。
+
+        proc = StreamingProcessor(sr=16000, temperature=1.3, frame_size=512)
+        for frame in frames:                 # 每帧恰好 frame_size 个采样
+            out = proc.process(frame)        # 长度为 frame_size 的整数倍 (可能为 0)
+        out = proc.flush(tail)               # 送入不足一帧的尾巴并取回剩余输出
+
+    - 相位声码器、重采样、低通滤波的状态都保存在内部的 TemperatureStream 里，跨调用延续；
+      温度不变时，所有输出拼起来与 utils.process_audio_speed_and_pitch 的整块结果在数值误差范围内一致
+    - latency：某个输入采样送入后，最多再送入这么多采样，它对应的输出就会被返回
+    - set_temperature() 可以在任意两帧之间调用：新管线先用最近的输入历史预热，
+      之后新旧两条管线并行跑完一段交叉淡化，切换处不会出现断裂或爆音
+    """
+
+    def __init__(self, sr: int, temperature: float = 1.0, frame_size: int = 1024, n_fft: int = 2048,
+                 hop_length: int = None, crossfade: int = None, dtype=np.float32):
+        self.sr = sr
+        self.frame_size = frame_size
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.dtype = np.dtype(dtype)
+        # 交叉淡化的长度 (输出采样)
+        self.crossfade = n_fft // 2 if crossfade is None else crossfade
+        # 切换温度时用来预热新管线的输入历史
+        self._history_len = 2 * n_fft
+        self._history = np.zeros(0, dtype=self.dtype)
+
+        self._stream = None
+        self.temperature = None
+
+        # 输出队列：凑满 frame_size 才整帧返回
+        self._queue = []
+        self._queued = 0
+        # 切换温度后的过渡状态
+        self._old_stream = None   # 交叉淡化期间继续运行的旧管线
+        self._old_buf = self._new_buf = np.zeros(0, dtype=self.dtype)   # 两边还没配对淡化的输出
+        self._fade_pos = 0
+        self._skip = 0            # 新管线还需丢弃的预热输出数
+        self._pending_temperature = None   # 淡化期间又收到的切换请求，只保留最新一个
+
+        self.set_temperature(temperature)
+
+    @property
+    def latency(self) -> int:
+        """当前温度下的延迟 (输入采样)；第一次读取某个温度时才测量，set_temperature 本身不会卡住音频线程"""
+        return _measure_latency(self.sr, round(float(self.temperature), 2), self.frame_size, self.n_fft,
+                                self.hop_length, self.dtype, self._history_len)
+
+    @property
+    def latency_seconds(self) -> float:
+        return self.latency / self.sr
+
+    def _new_stream(self, temperature: float) -> TemperatureStream:
+        return TemperatureStream(self.sr, temperature, n_fft=self.n_fft, hop_length=self.hop_length, dtype=self.dtype)
+
+    def set_temperature(self, temperature: float):
+        """
+        在两帧之间切换温度；与当前温度量化后相同时什么也不做。
+        交叉淡化期间 (约 crossfade 个输出采样) 两条管线同时运行，延迟会暂时取两者中较大的一个；
+        这期间再次切换只记下最新的温度，等本次淡化结束后再开始下一次。
+        """
+        if self._old_stream is not None:
+            self._pending_temperature = temperature
+            return
+        self._pending_temperature = None
+        if self.temperature is not None and round(float(temperature), 2) == round(float(self.temperature), 2):
+            return
+        new_stream = self._new_stream(temperature)
+        self.temperature = temperature
+
+        old_stream, self._stream = self._stream, new_stream
+        if old_stream is None:
+            return
+
+        # 1. 旧管线继续运行到淡化结束
+        self._old_stream = old_stream
+        self._fade_pos = 0
+
+        # 2. 新管线用最近的输入历史预热，丢弃预热输出，之后的输出与旧管线在时间上对齐
+        self._skip = new_stream.output_length(len(self._history))
+        self._absorb(new_stream.process(self._history), None)
+
+    def _finish_fade(self):
+        """结束交叉淡化：已经攒下的新管线输出直接入队，旧管线丢弃"""
+        self._enqueue(self._new_buf)
+        self._old_stream = None
+        self._old_buf = self._new_buf = np.zeros(0, dtype=self.dtype)
+
+    def _absorb(self, out: np.ndarray, old_out):
+        """
+        接收当前管线的输出 (以及淡化期间旧管线的输出)：
+        先丢弃预热部分，再把新旧两边逐个采样配对做线性交叉淡化，淡化结束后直接入队
+        """
+        if self._skip > 0:
+            drop = min(self._skip, len(out))
+            out = out[drop:]
+            self._skip -= drop
+        if self._old_stream is None:
+            self._enqueue(out)
+            return
+
+        if old_out is not None:
+            self._old_buf = _concat([self._old_buf, old_out], self.dtype)
+        self._new_buf = _concat([self._new_buf, out], self.dtype)
+        n = min(len(self._old_buf), len(self._new_buf), self.crossfade - self._fade_pos)
+        if n > 0:
+            w = (self._fade_pos + np.arange(1, n + 1, dtype=self.dtype)) / (self.crossfade + 1)
+            self._enqueue(self._old_buf[:n] * (1 - w) + self._new_buf[:n] * w)
+            self._old_buf, self._new_buf = self._old_buf[n:], self._new_buf[n:]
+            self._fade_pos += n
+        if self._fade_pos >= self.crossfade:
+            self._finish_fade()
+            if self._pending_temperature is not None:
+                self.set_temperature(self._pending_temperature)
+
+    def _enqueue(self, out: np.ndarray):
+        if len(out):
+            self._queue.append(np.asarray(out, dtype=self.dtype))
+            self._queued += len(out)
+
+    def _dequeue(self, full_frames_only: bool) -> np.ndarray:
+        if full_frames_only:
+            n = self._queued // self.frame_size * self.frame_size
+        else:
+            n = self._queued
+        if n == 0:
+            return np.zeros(0, dtype=self.dtype)
+        data = _concat(self._queue, self.dtype)
+        out, rest = data[:n], data[n:]
+        self._queue = [rest] if len(rest) else []
+        self._queued = len(rest)
+        return out
+
+    def _feed(self, block: np.ndarray):
+        self._history = np.concatenate([self._history, block])[-self._history_len:]
+        old_out = self._old_stream.process(block) if self._old_stream is not None else None
+        self._absorb(self._stream.process(block), old_out)
+
+    def process(self, frame: np.ndarray) -> np.ndarray:
+        """
+        送入恰好 frame_size 个采样，返回已经确定的输出 (长度为 frame_size 的整数倍，可能为 0)。
+        温度 > 1 时处理后的音频更短，平均每送入一帧得到的输出少于一帧；温度 < 1 时则更多。
+        """
+        frame = np.asarray(frame, dtype=self.dtype)
+        if frame.shape != (self.frame_size,):
+            raise ValueError(f"每帧必须恰好 {self.frame_size} 个单声道采样，收到形状 {frame.shape}")
+        self._feed(frame)
+        return self._dequeue(full_frames_only=True)
+
+    def flush(self, tail: np.ndarray = None) -> np.ndarray:
+        """输入结束：送入不足一帧的尾巴 (可选)，返回剩余的全部输出 (最后一段不补齐整帧)"""
+        if tail is not None and len(tail):
+            self._feed(np.asarray(tail, dtype=self.dtype))
+        old_out = self._old_stream.flush() if self._old_stream is not None else None
+        self._absorb(self._stream.flush(), old_out)
+        # 输入在淡化结束前就停了：剩下的新管线输出照常输出，还没开始的切换也不再需要
+        self._finish_fade()
+        self._pending_temperature = None
+        return self._dequeue(full_frames_only=False)
+
+
+def iter_source_blocks(source, block_size: int = 65536):
+    """
+    按块读取音频源，统一产出单声道 float32 块。
+    source 可以是音频文件路径，也可以是 NumPy 数组 / 内存映射数组 (例如解码缓存里的 .npy)。
+    """
+    if isinstance(source, np.ndarray):
+        for start in range(0, len(source), block_size):
+            yield np.asarray(source[start:start + block_size], dtype=np.float32)
+        return
+    with sf.SoundFile(source) as f:
+        for block in f.blocks(blocksize=block_size, dtype="float32", always_2d=True):
+            yield np.ascontiguousarray(block.mean(axis=1, dtype=np.float32))
+
+
+def iter_processed_blocks(blocks, sr: int, temperature: float, n_fft: int = 2048, cancel=None):
+    """
+    把输入块流逐块送进 TemperatureStream，边处理边产出结果块。
+    cancel (threading.Event) 置位后在下一块开始前抛出 worker.RenderCancelled
+    """
+    stream = TemperatureStream(sr, temperature, n_fft=n_fft)
+    for block in blocks:
+        worker.check_cancelled(cancel)
+        out = stream.process(block)
+        if len(out):
+            yield out
+    tail = stream.flush()
+    if len(tail):
+        yield tail
+
+
+def partial_path(out_path: str) -> str:
+    """process_file_streaming 写 .npy 时的临时文件；处理期间可以读取其中已经写好的前缀"""
+    return out_path + ".partial.npy"
+
+
+@metrics.timed("process_file_streaming")
+def process_file_streaming(source, out_path: str, temperature: float, sr: int = None,
+                           block_size: int = 65536, n_fft: int = 2048, progress=None, cancel=None) -> str:
+    """
+    流式处理整段录音并逐块写入 out_path，峰值内存只取决于块大小，与录音时长无关。
+
+    out_path 以 .npy 结尾时写成 float32 内存映射文件 (可直接 np.load(mmap_mode='r') 复用)：
+    输出长度事先已知，一开始就在 partial_path(out_path) 写好完整的文件头，之后各块原地写入并 flush，
+    每写完一块调用一次 progress(已写采样数, 总采样数)。处理期间读者可以 np.load(mmap_mode='r')
+    打开临时文件，其中前"已写采样数"个采样已是最终结果 (例如先播放开头)；全部写完才改名为 out_path。
+    否则按扩展名交给 soundfile 写成 wav/flac 等音频文件，文件头里的长度要到关闭时才写对，
+    要等函数返回后再读取。
+
+    Args:
+        source: 音频文件路径，或单声道数组 / 内存映射数组
+        out_path: 输出文件路径
+        temperature: 温度
+        sr: source 为数组时必须给出采样率；为文件时自动读取
+        block_size: 每块的采样点数，决定峰值内存
+        n_fft: 变速变调的 STFT 窗长 (与 utils.process_audio_speed_and_pitch 相同)
+        progress: 可选，每写完一块调用 progress(已写采样数, 总采样数)
+        cancel: 可选的 threading.Event，置位后在下一块开始前抛出 worker.RenderCancelled (不产生 out_path)
+    """
+    if isinstance(source, np.ndarray):
+        n_input = len(source)
+    else:
+        info = sf.info(source)
+        n_input, sr = info.frames, info.samplerate
+
+    blocks = iter_processed_blocks(iter_source_blocks(source, block_size), sr, temperature, n_fft=n_fft, cancel=cancel)
+
+    if out_path.endswith(".npy"):
+        n_output = TemperatureStream(sr, temperature).output_length(n_input)
+        tmp_path = partial_path(out_path)
+        out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(n_output,))
+        pos = 0
+        for block in blocks:
+            out[pos:pos + len(block)] = block
+            pos += len(block)
+            out.flush()
+            if progress is not None:
+                progress(pos, n_output)
+        del out
+        # 写完后再换成正式文件名，避免其它读者拿到写了一半的结果
+        os.replace(tmp_path, out_path)
+    else:
+        with sf.SoundFile(out_path, mode="w", samplerate=sr, channels=1, subtype="FLOAT"
+                          if out_path.lower().endswith(".wav") else None) as f:
+            for block in blocks:
+                f.write(block)
+                f.flush()
+    return out_path
@@ -0,0 +1,104 @@
+# test_streaming.py
+import os
+import threading
+
+import numpy as np
+import pytest
+
+import streaming
+import utils
+import worker
+
+
+def _glide(sr: int = 16000, seconds: float = 3.0) -> np.ndarray:
+    """带轻微颤音的正弦加少量噪声"""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(sr * seconds)) / sr
+    y = 0.3 * np.sin(2 * np.pi * 220 * t * (1 + 0.1 * np.sin(t))) + 0.02 * rng.standard_normal(len(t))
+    return y.astype(np.float32)
+
+
+@pytest.mark.parametrize("temperature", [0.7, 1.0, 1.5])
+@pytest.mark.parametrize("frame_size", [256, 1000])
+def test_streaming_processor_matches_offline(temperature, frame_size):
+    """逐帧送入 StreamingProcessor 的输出拼起来，与整块处理的结果在数值误差范围内一致，且延迟不超过 latency"""
+    sr = 16000
+    y = _glide(sr)
+    proc = streaming.StreamingProcessor(sr, temperature, frame_size=frame_size)
+    rate = utils._temperature_params(proc.temperature)[0] if proc.temperature != 1.0 else 1.0
+
+    # 1. 逐帧处理，记录"已送入但输出还没返回"的最大积压
+    outputs = []
+    n_in = n_out = 0
+    worst = 0.0
+    n_whole = len(y) // frame_size * frame_size
+    for start in range(0, n_whole, frame_size):
+        out = proc.process(y[start:start + frame_size])
+        assert len(out) % frame_size == 0
+        outputs.append(out)
+        n_in += frame_size
+        n_out += len(out)
+        worst = max(worst, n_in - n_out * rate)
+    outputs.append(proc.flush(y[n_whole:]))
+    streamed = np.concatenate(outputs)
+
+    # 2. 与整块处理比较
+    expected = utils.process_audio_speed_and_pitch(y, temperature, sr=sr)
+    assert len(streamed) == len(expected)
+    assert np.abs(streamed - expected).max() < 1e-5
+    assert worst <= proc.latency
+
+
+def test_set_temperature_crossfades_without_nan():
+    """帧间切换温度 (包括淡化期间连续切换) 不会产生非有限值，总输出长度只取决于输入"""
+    sr = 16000
+    y = _glide(sr)
+    proc = streaming.StreamingProcessor(sr, 1.0, frame_size=512)
+    outputs = []
+    for k, start in enumerate(range(0, len(y) // 512 * 512, 512)):
+        if k == 20:
+            proc.set_temperature(1.4)
+        elif k == 50:
+            proc.set_temperature(0.8)
+        elif k == 51:
+            proc.set_temperature(1.2)
+        outputs.append(proc.process(y[start:start + 512]))
+    outputs.append(proc.flush())
+    assert np.isfinite(np.concatenate(outputs)).all()
+    assert proc.temperature == 1.2
+
+
+def test_process_file_streaming_publishes_progress(tmp_path):
+    """写 .npy 时文件头一开始就写好，每块写完报告一次进度，处理中途临时文件里已写的开头就是最终结果"""
+    sr = 16000
+    y = _glide(sr, seconds=6.0)
+    out_path = str(tmp_path / "out.npy")
+    reports, heads = [], []
+
+    def progress(written, total):
+        # 处理期间像界面那样打开临时文件，读出已经写好的部分
+        partial = np.load(streaming.partial_path(out_path), mmap_mode="r")
+        assert len(partial) == total
+        heads.append(np.array(partial[:written]))
+        reports.append((written, total))
+
+    streaming.process_file_streaming(y, out_path, 1.3, sr=sr, block_size=8192, progress=progress)
+
+    final = np.load(out_path)
+    written = [w for w, _ in reports]
+    assert len(reports) > 1
+    assert written == sorted(written) and written[-1] == len(final)
+    assert {t for _, t in reports} == {len(final)}
+    for head in heads:
+        assert np.array_equal(head, final[:len(head)])
+
+
+def test_process_file_streaming_cancel(tmp_path):
+    """取消信号在写完第一块后置位：下一块开始前抛出 RenderCancelled，不产生正式输出文件"""
+    sr = 16000
+    out_path = str(tmp_path / "out.npy")
+    cancel = threading.Event()
+    with pytest.raises(worker.RenderCancelled):
+        streaming.process_file_streaming(_glide(sr), out_path, 1.3, sr=sr, block_size=8192,
+                                         progress=lambda written, total: cancel.set(), cancel=cancel)
+    assert not os.path.exists(out_path)
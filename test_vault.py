@@ -0,0 +1,165 @@
+# test_vault.py
+import io
+import os
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+import vault
+
+
+def _wav_bytes(seed: int, seconds: float = 0.5, sr: int = 16000, subtype: str = "PCM_16") -> bytes:
+    """确定性的随机内容 WAV，不同 seed 得到不同的指纹"""
+    rng = np.random.default_rng(seed)
+    buffer = io.BytesIO()
+    sf.write(buffer, (0.1 * rng.standard_normal(int(sr * seconds))).astype(np.float32), sr,
+             format="WAV", subtype=subtype)
+    return buffer.getvalue()
+
+
+def _blob_files(vault_dir: str) -> list:
+    return sorted(os.listdir(os.path.join(vault_dir, vault.BLOB_DIR_NAME)))
+
+
+def test_same_content_is_stored_once(tmp_path):
+    """内容相同的两个名字共用一个音频块；删掉其中一个名字不会删除内容"""
+    store = vault.VaultStore(str(tmp_path))
+    data = _wav_bytes(0)
+    assert store.add("a.wav", data) is None
+    assert store.add("b.wav", data) is None
+    assert len(_blob_files(str(tmp_path))) == 1
+    assert store.blobs[store.get("a.wav")["hash"]]["refs"] == 2
+
+    assert store.remove("a.wav") is None
+    assert store.read_bytes("b.wav") == data
+    audio_hash = store.get("b.wav")["hash"]
+    assert store.remove("b.wav") == audio_hash
+    assert _blob_files(str(tmp_path)) == []
+
+
+def test_readding_a_name_with_new_content_frees_the_old_blob(tmp_path):
+    """同名上传新内容：旧内容只被这个名字引用时被删除，add 返回它的指纹"""
+    store = vault.VaultStore(str(tmp_path))
+    store.add("a.wav", _wav_bytes(0))
+    old_hash = store.get("a.wav")["hash"]
+
+    assert store.add("a.wav", _wav_bytes(1)) == old_hash
+    assert old_hash not in store.blobs
+    assert len(_blob_files(str(tmp_path))) == 1
+    # 同名同内容重复上传什么也不释放
+    assert store.add("a.wav", _wav_bytes(1)) is None
+
+
+def test_readding_a_shared_name_keeps_the_old_blob(tmp_path):
+    """旧内容仍被其它名字引用时只减少引用计数"""
+    store = vault.VaultStore(str(tmp_path))
+    data = _wav_bytes(0)
+    store.add("a.wav", data)
+    store.add("b.wav", data)
+    old_hash = store.get("a.wav")["hash"]
+
+    assert store.add("a.wav", _wav_bytes(1)) is None
+    assert store.blobs[old_hash]["refs"] == 1
+    assert store.read_bytes("b.wav") == data
+
+
+def test_manifest_reload_recounts_refs(tmp_path):
+    """重新打开金库时按名字表重新核对引用计数"""
+    store = vault.VaultStore(str(tmp_path))
+    data = _wav_bytes(0)
+    store.add("a.wav", data)
+    store.add("b.wav", data)
+
+    reopened = vault.VaultStore(str(tmp_path))
+    assert sorted(reopened.names()) == ["a.wav", "b.wav"]
+    assert reopened.blobs[reopened.get("a.wav")["hash"]]["refs"] == 2
+
+
+def _tone_bytes(seed: int, seconds: float = 1.0, sr: int = 16000) -> bytes:
+    """正弦加少量噪声的 16 bit WAV：FLAC 压得小，转码后会进入打包文件"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(sr * seconds)) / sr
+    y = 0.3 * np.sin(2 * np.pi * (200 + 50 * seed) * t) + 0.001 * rng.standard_normal(len(t))
+    buffer = io.BytesIO()
+    sf.write(buffer, y.astype(np.float32), sr, format="WAV", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+def _pcm(data: bytes) -> np.ndarray:
+    return sf.read(io.BytesIO(data), dtype="int16")[0]
+
+
+def _packed_store(vault_dir: str, **named_bytes) -> vault.VaultStore:
+    store = vault.VaultStore(vault_dir, use_pack=True)
+    for name, data in named_bytes.items():
+        store.add(name, data)
+    store.flush_transcodes()
+    return store
+
+
+def test_pack_dir_is_created_lazily(tmp_path):
+    """不启用打包的金库不会创建 packs 目录"""
+    store = vault.VaultStore(str(tmp_path))
+    store.add("a.wav", _tone_bytes(0))
+    assert not os.path.exists(os.path.join(str(tmp_path), vault.PACK_DIR_NAME))
+
+
+def test_pack_round_trip_is_lossless(tmp_path):
+    """转码进打包文件后删除原始文件，读回的 FLAC 逐采样等于原始 PCM"""
+    data = _tone_bytes(0)
+    store = _packed_store(str(tmp_path), **{"a.wav": data})
+    record = store.blobs[store.get("a.wav")["hash"]]
+    assert record["packed"] and record["stored_size"] < len(data)
+    assert _blob_files(str(tmp_path)) == []
+
+    packed = store.read_bytes("a.wav")
+    assert packed[:4] == b"fLaC"
+    assert np.array_equal(_pcm(packed), _pcm(data))
+
+
+@pytest.mark.parametrize("use_pack", [False, True])
+@pytest.mark.parametrize("start, frames", [(0, -1), (0, 1000), (12345, 4000), (15900, -1)])
+def test_read_frames_matches_full_decode(tmp_path, use_pack, start, frames):
+    """局部读取 (原始文件或打包记录) 与整段解码后截取的结果一致"""
+    data = _tone_bytes(1)
+    if use_pack:
+        store = _packed_store(str(tmp_path), **{"a.wav": data})
+    else:
+        store = vault.VaultStore(str(tmp_path))
+        store.add("a.wav", data)
+    full, sr = sf.read(io.BytesIO(data), dtype="float32")
+    expected = full[start:] if frames < 0 else full[start:start + frames]
+
+    y, y_sr = store.read_frames("a.wav", start, frames)
+    assert y_sr == sr
+    assert np.array_equal(y, expected)
+
+
+def test_remove_then_compact(tmp_path):
+    """删除占打包文件大半的条目后后台整理：换成新一代打包文件，垃圾清零，其余条目完好"""
+    long_data, short_data = _tone_bytes(0, seconds=3.0), _tone_bytes(1, seconds=0.5)
+    store = _packed_store(str(tmp_path), **{"long.wav": long_data, "short.wav": short_data})
+    old_pack = store._pack.pack_path
+
+    store.remove("long.wav")
+    store.flush_transcodes()
+    assert store._pack.garbage_bytes == 0
+    assert store._pack.pack_path != old_pack and not os.path.exists(old_pack)
+    assert np.array_equal(_pcm(store.read_bytes("short.wav")), _pcm(short_data))
+
+
+@pytest.mark.parametrize("use_pack", [False, True])
+def test_manifest_reload_with_packed_entries(tmp_path, use_pack):
+    """重新打开金库 (无论之后是否继续打包) 时，已打包的条目仍从打包文件读取，不会重新转码"""
+    data = _tone_bytes(0)
+    _packed_store(str(tmp_path), **{"a.wav": data, "b.wav": data})
+
+    reopened = vault.VaultStore(str(tmp_path), use_pack=use_pack)
+    reopened.flush_transcodes()
+    audio_hash = reopened.get("a.wav")["hash"]
+    assert reopened.blobs[audio_hash]["packed"] and reopened.blobs[audio_hash]["refs"] == 2
+    assert _blob_files(str(tmp_path)) == []
+    assert np.array_equal(_pcm(reopened.read_bytes("b.wav")), _pcm(data))
+    y, _ = reopened.read_frames("a.wav", 100, 50)
+    assert np.array_equal(y, sf.read(io.BytesIO(data), dtype="float32")[0][100:150])
@@ -0,0 +1,121 @@
+# test_worker.py
+import threading
+
+import pytest
+
+import worker
+
+
+def _gated(gate: threading.Event, value, started: threading.Event = None):
+    """先登记开始，再等 gate 放行后返回 value 的任务"""
+    def fn(cancel):
+        if started is not None:
+            started.set()
+        assert gate.wait(5)
+        return value
+    return fn
+
+
+def _until_cancelled(started: threading.Event):
+    """反复检查取消信号、直到被顶替才退出的长任务"""
+    def fn(cancel):
+        started.set()
+        assert cancel.wait(5)
+        worker.check_cancelled(cancel)
+        return "never"
+    return fn
+
+
+def test_supersede_while_queued():
+    """线程池被其它会话占满时，排队中的请求被新请求直接换掉，旧请求从未开始执行"""
+    pool = worker.RenderWorkerPool(max_workers=1)
+    gate, blocker_started = threading.Event(), threading.Event()
+    pool.request(worker.RenderSlot(), "blocker", _gated(gate, "x", blocker_started))
+    assert blocker_started.wait(5)
+
+    slot = worker.RenderSlot()
+    ran = []
+    pool.request(slot, 1.2, lambda cancel: ran.append(1.2))
+    pool.request(slot, 1.5, lambda cancel: ran.append(1.5) or "1.5")
+    assert pool.superseded == 1
+    gate.set()
+
+    assert slot.wait(1.5, 5)
+    assert slot.latest() == (1.5, "1.5")
+    assert ran == [1.5]
+    assert not slot.wait(1.2, 0)
+
+
+def test_cancel_before_start():
+    """排队等正在执行的任务结束的请求，在开始之前被缓存命中 (show) 作废，不会再执行"""
+    pool = worker.RenderWorkerPool(max_workers=2)
+    slot = worker.RenderSlot()
+    gate, started = threading.Event(), threading.Event()
+    pool.request(slot, 1.0, _gated(gate, "1.0", started))
+    assert started.wait(5)
+
+    ran = []
+    pool.request(slot, 1.3, lambda cancel: ran.append(1.3))
+    slot.show(1.4, "cached")
+    assert slot.busy
+    gate.set()
+
+    # 1.0 收到了取消信号但没有检查点，照常算完；排队的 1.3 从未开始
+    assert slot.wait(1.0, 5)
+    assert slot.latest() == (1.0, "1.0")
+    assert ran == []
+    assert not slot.busy
+
+
+def test_running_job_cancelled_at_checkpoint():
+    """正在执行的任务被新请求顶替时收到取消信号，在检查点退出，既不记为失败也不覆盖结果"""
+    pool = worker.RenderWorkerPool(max_workers=2)
+    slot = worker.RenderSlot()
+    started = threading.Event()
+    pool.request(slot, 0.8, _until_cancelled(started))
+    assert started.wait(5)
+
+    pool.request(slot, 1.6, lambda cancel: "1.6")
+    assert slot.wait(1.6, 5)
+    assert slot.latest() == (1.6, "1.6")
+    assert slot.error is None
+    assert pool.superseded == 1
+
+
+def test_rerequest_cancelled_running_key_runs_again():
+    """拖走又拖回正在执行的温度：它已经收到取消信号，需要重新排队而不是被当作仍在计算"""
+    pool = worker.RenderWorkerPool(max_workers=2)
+    slot = worker.RenderSlot()
+    started = threading.Event()
+    pool.request(slot, 0.8, _until_cancelled(started))
+    assert started.wait(5)
+
+    pool.request(slot, 1.6, lambda cancel: "1.6")
+    pool.request(slot, 0.8, lambda cancel: "0.8")
+    assert slot.wait(0.8, 5)
+    assert slot.latest() == (0.8, "0.8")
+
+
+def test_error_propagation():
+    """任务抛出的异常记录在 slot.error 里，wait 返回 False，槽位随即空闲"""
+    pool = worker.RenderWorkerPool(max_workers=1)
+    slot = worker.RenderSlot()
+
+    def fn(cancel):
+        raise ValueError("boom")
+
+    pool.request(slot, 1.1, fn)
+    assert not slot.wait(1.1, 5)
+    key, error = slot.error
+    assert key == 1.1 and isinstance(error, ValueError)
+    assert slot.latest() == (None, None)
+    assert not slot.busy
+
+
+def test_check_cancelled():
+    cancel = threading.Event()
+    worker.check_cancelled(None)
+    worker.check_cancelled(cancel)
+    cancel.set()
+    with pytest.raises(worker.RenderCancelled):
+        worker.check_cancelled(cancel)
@@ -1,10 +1,12 @@
 # ui_components.py
 import streamlit as st
-import soundfile as sf
-import io  
 import utils # 导入工具箱以调用绘图
+import metrics
 from audio_recorder_streamlit import audio_recorder
 
+# 质量档位 → 界面文字 (档位参数见 utils.QUALITY_TIERS)
+QUALITY_LABELS = {"preview": "⚡ 试听 (16 kHz)", "final": "💎 精修 (原始采样率)"}
+
 def render_sidebar_inputs():
     """渲染侧边栏：上半部分 (数据输入区)"""
     with st.sidebar:  
@@ -27,7 +29,7 @@ def render_sidebar_inputs():
     return uploaded_file, recorded_audio_bytes
 
 
-def render_sidebar_history():
+def render_sidebar_history(vault):
     """渲染侧边栏：下半部分 (历史记录区)"""
     selected_history = None
     delete_triggered = False  # 是否按下了融化按钮
@@ -35,12 +37,15 @@ def render_sidebar_history():
     
     with st.sidebar:
         st.subheader("🗂️ 流年冰迹")  
-        vault = st.session_state.get('audio_vault', {})
+        # 只依赖金库索引 (文件名、时长等元数据)，不触碰任何音频内容
+        names = vault.names()
         
-        if vault:
+        if names:
             st.caption('"**点击聆听**"')
-            for name in reversed(list(vault.keys())):
-                if st.button(f"❄️ {name}", use_container_width=True):
+            for name in reversed(names):
+                entry = vault.get(name)
+                hint = f"{entry['duration']:.1f} s · {entry['sr']} Hz" if entry["duration"] else None
+                if st.button(f"❄️ {name}", help=hint, use_container_width=True):
                     selected_history = name
             
             st.divider()
@@ -49,7 +54,7 @@ def render_sidebar_history():
             st.caption('"**融化冰迹**"')
             files_to_delete = st.multiselect(
                 label="选择文件",
-                options=list(reversed(list(vault.keys()))),
+                options=list(reversed(names)),
                 default=[],
                 label_visibility="collapsed" # 隐藏多选框自带的标签，保持界面整洁
             )
@@ -64,6 +69,17 @@ def render_sidebar_history():
     # 将选择信号和删除信号一并传递给主程序状态机
     return selected_history, delete_triggered, files_to_delete
 
+def render_sidebar_playback():
+    """渲染侧边栏：播放格式设置 (压缩后再发给浏览器，慢速网络下更省流量)"""
+    with st.sidebar:
+        st.divider()
+        st.subheader("🎧 传音之器")
+        fmt = st.selectbox("播放格式", list(utils.PLAYBACK_FORMATS), index=0,
+                           help="FLAC 无损压缩；OGG (Vorbis) 有损但体积最小；WAV 不压缩")
+        quality = st.slider("音质", 0.1, 1.0, 0.6, 0.1, disabled=(fmt == "WAV"),
+                            help="OGG：越高越清晰、体积越大；FLAC：只影响压缩力度，始终无损")
+    return fmt, quality
+
 def render_header():
     """渲染主标题区"""
     st.title("🧊 言冰 (Voiceice)")
@@ -78,32 +94,106 @@ def render_controls():
         st.caption("*(Kindle the Heart)*")
     with col_slider:
         # 这里的 0.5 - 2.0 直接对应 utils 里的倍速
-        temperature = st.slider("调整心火的炽度...", 0.5, 2.0, 1.0, 0.1)
+        temperature = st.slider("调整心火的炽度...", utils.TEMP_MIN, utils.TEMP_MAX, 1.0, utils.TEMP_STEP)
         
         if temperature > 1.2:
             st.caption("当前状态：**烈焰** (火力十足)")
         elif temperature < 0.8:
             st.caption("当前状态：**温火** (轻言细语)")
+
+        # 试听档位在 16 kHz 副本上处理，拖动滑块时更跟手；需要导出或细听时切到精修
+        tier = st.radio("渲染精度", list(QUALITY_LABELS), format_func=QUALITY_LABELS.get,
+                        horizontal=True, key="quality_tier")
     
-    return temperature
+    return temperature, tier
 
-def render_analysis_report(temperature):
-    """分析报告UI"""
+# 解语手札展示的特征：(键, 标签, 数值格式, 差值格式)
+REPORT_FEATURES = [
+    ("rms_db", "响度 (Loudness)", "{:.1f} dBFS", "{:+.1f} dB"),
+    ("centroid_hz", "明亮度 (Brightness)", "{:.0f} Hz", "{:+.0f} Hz"),
+    ("zcr", "嘶擦度 (ZCR)", "{:.3f}", "{:+.3f}"),
+    ("speaking_rate", "语速 (Pace)", "{:.2f} 音节/秒", "{:+.2f}"),
+    ("pitch_median_hz", "音高 (Pitch)", "{:.0f} Hz", "{:+.0f} Hz"),
+    ("pitch_range_semitones", "音域 (Range)", "{:.1f} 半音", "{:+.1f}"),
+]
+
+def render_analysis_report(temperature, analysis=None):
+    """
+    分析报告UI：处理后录音的声学特征，差值相对于原始录音
+    analysis: (原始特征, 处理后特征, 后台是否仍在计算)，见 main.get_features
+    """
     st.header("📊 情感手札")
-    # 简单的模拟算法
-    aggression = max(0, 80 * (temperature - 0.8))
-    calmness = max(0, 100 - aggression)
-    
-    m1, m2, m3 = st.columns(3)
-    m1.metric("锋芒 (Sharpness)", f"{aggression:.1f}%", delta_color="inverse") # 不知道咋翻译了，你们自己预览一下吧
-    m2.metric("静气 (Calmness)", f"{calmness:.1f}%")
-    m3.metric("流速 (Flow)", f"{temperature}x")
-    
-    msg = "言语过急，恐伤人心。" if temperature > 1.2 else "缓歌慢语，如春风化雨。" # python特有的三元运算形式（类似于C中的?运算符）
+    original, processed, pending = analysis if analysis is not None else (None, None, False)
+    if original is None or processed is None:
+        if pending:
+            st.info("🔬 正在分析声学特征 (音高估计较慢)，完成后自动刷新...")
+        else:
+            st.warning("声学特征暂不可用")
+        return
+
+    columns = st.columns(3) + st.columns(3)
+    for column, (key, label, value_fmt, delta_fmt) in zip(columns, REPORT_FEATURES):
+        value, base = processed.get(key), original.get(key)
+        column.metric(label, "—" if value is None else value_fmt.format(value),
+                      None if value is None or base is None else delta_fmt.format(value - base))
+    if processed.get("voiced_ratio") is not None:
+        st.caption(f"有声比例 {processed['voiced_ratio']:.0%} · 音高分析覆盖 {processed['pitch_seconds_analyzed']:.0f} 秒")
+
+    # 语速相对原始录音快了多少；估不出语速时退回到看温度
+    if processed.get("speaking_rate") and original.get("speaking_rate"):
+        hurried = processed["speaking_rate"] / original["speaking_rate"] > 1.05
+    else:
+        hurried = temperature > 1.2
+    msg = "言语过急，恐伤人心。" if hurried else "缓歌慢语，如春风化雨。" # python特有的三元运算形式（类似于C中的?运算符）
     st.info(f"💡 解语：{msg}")
 
-def render_tabs_content(y_original, y_processed, sr, temperature):
-    """渲染底部的三个标签页内容"""
+def render_analysis_panel(temperature, get_analysis, poll_seconds):
+    """
+    解语手札放在一个局部片段 (st.fragment) 里：特征还在后台计算时只有这一块定时重跑，
+    声谱图、波形与播放数据不会跟着重建和重发。
+    get_analysis: 无参函数，返回 (原始特征, 处理后特征, 后台是否仍在计算)
+    """
+    pending = get_analysis()[2]
+
+    @st.fragment(run_every=poll_seconds if pending else None)
+    def _panel():
+        analysis = get_analysis()
+        render_analysis_report(temperature, analysis)
+        if pending and not analysis[2]:
+            # 算完了：整页重跑一次，换成不再定时刷新的片段
+            st.rerun()
+
+    _panel()
+
+def render_partial_preview(temperature, partial, sr):
+    """
+    长录音首次渲染时代替三个标签页：渲染进度，以及已经写好的开头的试听
+    partial: (已写采样数, 总采样数, 开头的 (播放数据, MIME) 或 None)，渲染还没开始时为 None
+    """
+    st.divider()
+    if partial is None:
+        st.info(f"🔥 火候 {temperature:.1f} 的长录音渲染正在排队...")
+        return
+    written, total, head = partial
+    st.progress(written / max(total, 1),
+                text=f"🔥 火候 {temperature:.1f} 正在渲染长录音：{written / sr:.0f} / {total / sr:.0f} 秒")
+    if head is not None:
+        st.markdown("**💧 先听开头**")
+        st.audio(head[0], format=head[1])
+
+@metrics.timed("render_tabs")
+def render_tabs_content(temperature, spectrograms, waveforms, playback, get_analysis=None, export=None,
+                        poll_seconds=0.5):
+    """
+    渲染底部的三个标签页内容
+    spectrograms: (原始, 处理后) 两座已缓存的声谱图金字塔
+    waveforms: (原始, 处理后) 两座已缓存的波形包络金字塔
+    playback: (原始, 处理后) 两份已缓存的 (编码后的字节或落盘文件路径, MIME) 播放数据
+    get_analysis: 无参函数，返回 (原始特征, 处理后特征, 后台是否仍在计算)，交给解语手札
+    poll_seconds: 特征仍在后台计算时，解语手札隔多久刷新一次
+    export: 精修档位下给出 ((无损编码数据或落盘文件路径, MIME), 文件名不含扩展名)，
+            与播放格式无关，始终是无损的 FLAC；试听档位为 None，不提供导出
+    """
     st.divider()
     tab1, tab2, tab3 = st.tabs(["🌊 见字如面", "🔬 闻声绘影", "📝 解语手札"])
 
@@ -113,29 +203,62 @@ def render_tabs_content(y_original, y_processed, sr, temperature):
         with c1:
             st.markdown("**🧊 初结之冰 (Original)**")
             # 切换为调用新的 plotly 绘制函数
-            fig1 = utils.draw_waveform_plotly(y_original, sr, "Frozen Shape", "#87CEFA")
+            fig1 = utils.draw_waveform_plotly(waveforms[0], "Frozen Shape", "#87CEFA")
             # 使用 st.plotly_chart 渲染，并接管容器宽度
             st.plotly_chart(fig1, use_container_width=True) 
-            st.audio(y_original, sample_rate=sr) 
+            # 播放数据已按 (内容指纹, 温度, 格式) 编码并缓存，重跑时不再重新编码
+            st.audio(playback[0][0], format=playback[0][1])
             
         with c2:
             st.markdown(f"**💧 春水初生 (Temp: {temperature})**")
             plot_color = "#FF7F50" if temperature > 1.0 else "#40E0D0"
-            fig2 = utils.draw_waveform_plotly(y_processed, sr, "Flowing Shape", plot_color)
+            fig2 = utils.draw_waveform_plotly(waveforms[1], "Flowing Shape", plot_color)
             st.plotly_chart(fig2, use_container_width=True)
             
-            virtual_file = io.BytesIO()
-            sf.write(virtual_file, y_processed, sr, format='WAV')
-            st.audio(virtual_file, format='audio/wav')
+            st.audio(playback[1][0], format=playback[1][1])
+            if export is not None:
+                (data, mime), export_name = export
+                if isinstance(data, str):
+                    with open(data, "rb") as f:
+                        data = f.read()
+                extension = mime.split("/")[-1]
+                st.download_button("💾 导出精修结果", data, file_name=f"{export_name}.{extension}",
+                                   mime=mime, use_container_width=True)
 
     # --- Tab 2: 声谱 ---
     with tab2:
         c3, c4 = st.columns(2)
         with c3:
-            st.pyplot(utils.draw_spectrogram(y_original, sr, "Frozen Spectrum"))
+            st.plotly_chart(utils.draw_spectrogram(spectrograms[0], "Frozen Spectrum"), use_container_width=True)
         with c4:
-            st.pyplot(utils.draw_spectrogram(y_processed, sr, "Melted Spectrum"))
+            st.plotly_chart(utils.draw_spectrogram(spectrograms[1], "Melted Spectrum"), use_container_width=True)
 
     # --- Tab 3: 总结 ---
     with tab3:
-        render_analysis_report(temperature)
\ No newline at end of file
+        if get_analysis is None:
+            render_analysis_report(temperature)
+        else:
+            render_analysis_panel(temperature, get_analysis, poll_seconds)
+
+def render_debug_panel(registry):
+    """侧边栏调试面板：各阶段的滚动耗时统计，以及 JSON / Prometheus 导出"""
+    with st.sidebar:
+        with st.expander("🛠️ 调试面板 (分阶段耗时)"):
+            snapshot = registry.snapshot()
+            if not snapshot:
+                st.caption("还没有记录到任何阶段")
+                return
+            rows = [{"stage": name, **stats} for name, stats in snapshot.items()]
+            st.dataframe(rows, hide_index=True, use_container_width=True)
+            st.caption(f"滚动窗口：每个阶段最近 {metrics.WINDOW} 次")
+
+            c1, c2, c3 = st.columns(3)
+            with c1:
+                st.download_button("JSON", registry.to_json(), file_name="voiceice_metrics.json",
+                                   mime="application/json", use_container_width=True)
+            with c2:
+                st.download_button("Prometheus", registry.to_prometheus(), file_name="voiceice_metrics.prom",
+                                   mime="text/plain", use_container_width=True)
+            with c3:
+                if st.button("清空", use_container_width=True):
+                    registry.reset()
@@ -1,12 +1,48 @@
-import librosa
-import librosa.display
-import scipy.signal as signal
+import base64
+import functools
+import io
+import os
+import tempfile
+import time
+import soundfile as sf
 import numpy as np
-import matplotlib.pyplot as plt 
-import plotly.graph_objects as go
+import metrics
+# 重型库按需导入：librosa / scipy 只在真正处理音频的函数内部导入 (首次导入要一两秒)，
+# 绘图库 (plotly) 只在绘图函数内部导入；页面首屏与批处理等无界面入口都不必为它们付出加载代价
 # ==========================================
 # 【第一部分：核心后端算法】 
 # 核心数值计算库
+@metrics.timed("decode")
+def decode_audio_bytes(audio_bytes: bytes):
+    """
+    将二进制音频流解码为单声道 float32 数组，保留原始采样率 (等价于 librosa.load(sr=None))。
+    
+    优先用 soundfile 直接从内存缓冲区解码 (wav/flac/ogg/mp3 等)，不产生任何临时文件；
+    只有 soundfile 不认识的格式才退回到 librosa 的 audioread 后端，
+    此时需要一个真实路径，临时文件用完立即删除。
+    
+    Returns:
+        (y, sr): 单声道 float32 音频与采样率
+    """
+    try:
+        y, sr = sf.read(io.BytesIO(audio_bytes), dtype="float32", always_2d=True)
+        # (采样点, 声道) → 与 librosa.to_mono 相同的声道平均
+        return np.ascontiguousarray(y.mean(axis=1, dtype=np.float32)), sr
+    except Exception:
+        pass
+
+    import librosa
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(delete=False) as tmp:
+            tmp.write(audio_bytes)
+            tmp_path = tmp.name
+        y, sr = librosa.load(tmp_path, sr=None)
+        return y, sr
+    finally:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
 def process_audio_speed_by_temp(audio_series: np.ndarray, temperature: float) -> np.ndarray:
     
     # audio_series,temperature 为参数，后面的为类型注解
@@ -33,6 +69,7 @@ def process_audio_speed_by_temp(audio_series: np.ndarray, temperature: float) ->
     rate = np.clip(rate, 0.1, 5.0)
     
     # 3. 调用 Librosa 库方法
+    import librosa
     try:
         processed_data = librosa.effects.time_stretch(y = audio_series, rate = rate)
     #  time_stretch 改变速度但不改变音高
@@ -58,6 +95,7 @@ def process_audio_pitch_by_temp(audio_series: np.ndarray, temperature: float) ->
     # sr (采样率) 默认为 22050，这是 librosa 加载音频时的默认值。
     # 如果你的音频不是 22050Hz，这里的音高变化在时间轴上可能会有细微偏差，但不会报错。
     #pitch_shift函数实现音频音高调整
+    import librosa
     try:
         processed_data = librosa.effects.pitch_shift(
             y=audio_series, 
@@ -69,14 +107,18 @@ def process_audio_pitch_by_temp(audio_series: np.ndarray, temperature: float) ->
         return audio_series
     return processed_data
 
-def apply_lowpass_filter(audio_series: np.ndarray, sr: int, cutoff_freq: float) -> np.ndarray:
+def _working_dtype(audio_series: np.ndarray):
     """
-    使用巴特沃斯低通滤波器 (Butterworth Low-pass Filter) 削弱刺耳的高频信号。
-    
-    Args:
-        audio_series: 音频时间序列
-        sr: 采样率
-        cutoff_freq: 截止频率 (Hz)。高于此频率的信号将被大幅削弱。
+    DSP 管线的数据类型约定：全程 float32 (与 soundfile / librosa 解码结果一致)；
+    只有调用方明确传入 float64 时才保持 float64。
+    """
+    return np.float64 if audio_series.dtype == np.float64 else np.float32
+
+@functools.lru_cache(maxsize=256)
+def _design_lowpass(sr: int, cutoff_freq: float, dtype=np.float32) -> np.ndarray:
+    """
+    设计低通滤波器，二阶节 (SOS) 形式，按 (采样率, 截止频率, 数据类型) 缓存。
+    整块处理与流式处理共用同一份设计；系数与信号同为 float32 时，滤波全程不会升到 float64。
     """
     # 1. 计算奈奎斯特频率 (Nyquist frequency)，理论上它是采样率的一半
     nyquist = 0.5 * sr
@@ -88,89 +130,353 @@ def apply_lowpass_filter(audio_series: np.ndarray, sr: int, cutoff_freq: float)
     normal_cutoff = np.clip(normal_cutoff, 0.01, 0.99)
     
     # 3. 设计一个 2 阶的巴特沃斯滤波器 (阶数越高，过滤边缘越陡峭、越干净利落)
-    b, a = signal.butter(2, normal_cutoff, btype='low', analog=False)
+    # 缓存的系数被所有调用方共享，调用方不得原地修改 (scipy 的 sosfilt 不接受只读数组，无法强制设为只读)
+    from scipy import signal
+    return signal.butter(2, normal_cutoff, btype='low', analog=False, output='sos').astype(dtype)
+
+@metrics.timed("lowpass")
+def apply_lowpass_filter(audio_series: np.ndarray, sr: int, cutoff_freq: float) -> np.ndarray:
+    """
+    使用巴特沃斯低通滤波器 (Butterworth Low-pass Filter) 削弱刺耳的高频信号。
+    
+    Args:
+        audio_series: 音频时间序列
+        sr: 采样率
+        cutoff_freq: 截止频率 (Hz)。高于此频率的信号将被大幅削弱。
+    """
+    dtype = _working_dtype(np.asarray(audio_series))
+    sos = _design_lowpass(int(sr), float(cutoff_freq), dtype)
     
-    # 4. 应用滤波器。使用 filtfilt 可以进行正反向两次滤波，保证波形不发生相位偏移
-    filtered_audio = signal.filtfilt(b, a, audio_series)
+    # 应用滤波器。使用 sosfiltfilt 可以进行正反向两次滤波，保证波形不发生相位偏移
+    from scipy import signal
+    filtered_audio = signal.sosfiltfilt(sos, np.asarray(audio_series, dtype=dtype))
     
     return filtered_audio
 
-def apply_saturation(audio_series: np.ndarray, drive: float) -> np.ndarray:
+@metrics.timed("saturation")
+def apply_saturation(audio_series: np.ndarray, drive: float, out: np.ndarray = None) -> np.ndarray:
     """
     【新增算法】软削峰饱和失真 (Soft Clipping Saturation)
     利用双曲正切函数 tanh，在不爆音的前提下，强行增加谐波能量，模拟"嘶吼感"。
+    out 与 NumPy 的同名参数一致：传入 audio_series 本身即原地计算，不再分配新数组。
     """
     # drive 越大，波形被挤压得越厉害，失真/炽热感越强
-    return np.tanh(audio_series * drive)
+    out = np.multiply(audio_series, drive, out=out)
+    return np.tanh(out, out=out)
+
+@metrics.timed("stretch_and_shift")
+def stretch_and_shift(audio_series: np.ndarray, sr: int, rate: float, n_steps: float,
+                      n_fft: int = 2048, hop_length: int = None) -> np.ndarray:
+    """
+    融合变速变调引擎：只做一次 STFT 分析/合成，同时完成 Time Stretch 与 Pitch Shift。
+    
+    librosa 的 pitch_shift 内部本身就是"先变速、再重采样"，
+    所以 time_stretch → pitch_shift 的链式调用等于做了两次相位声码器 (两轮 STFT/ISTFT)。
+    这里把两次变速的速率相乘合并为一次，最后只做一次重采样把音高拉回目标位置。
+    
+    Args:
+        audio_series: 音频时间序列
+        sr: 采样率
+        rate: 播放速率 (>1 变快, <1 变慢)
+        n_steps: 音高偏移的半音数
+    
+    Returns:
+        np.ndarray: 长度与链式调用一致，即 round(len(audio_series) / rate)
+    """
+    if hop_length is None:
+        hop_length = n_fft // 4
+
+    # 1. pitch_shift 等价于以 pitch_rate 变速后再重采样，两次变速合并为一个总速率
+    pitch_rate = 2.0 ** (-float(n_steps) / 12)
+    total_rate = rate * pitch_rate
+    target_len = int(round(len(audio_series) / rate))
+
+    # 2. 唯一的一轮 STFT → 相位声码器 → ISTFT
+    import librosa
+    stft_matrix = librosa.stft(audio_series, n_fft=n_fft, hop_length=hop_length)
+    if total_rate != 1.0:
+        stft_matrix = librosa.phase_vocoder(stft_matrix, rate=total_rate, hop_length=hop_length, n_fft=n_fft)
+    current_audio = librosa.istft(
+        stft_matrix,
+        hop_length=hop_length,
+        n_fft=n_fft,
+        dtype=audio_series.dtype,
+        length=int(round(len(audio_series) / total_rate)),
+    )
+
+    # 3. 重采样完成变调 (与 librosa.effects.pitch_shift 的映射完全相同)
+    if n_steps != 0.0:
+        current_audio = librosa.resample(current_audio, orig_sr=float(sr) / pitch_rate, target_sr=sr)
+
+    # 4. 裁剪/补零到链式调用的输出长度
+    return librosa.util.fix_length(current_audio, size=target_len)
+
+# 温度滑块的取值范围与步长；滑块、预渲染网格与离线特征补算共用这一份定义，保证各处档位一致
+TEMP_MIN, TEMP_MAX, TEMP_STEP = 0.5, 2.0, 0.1
+TEMPERATURE_GRID = [round(TEMP_MIN + i * TEMP_STEP, 1) for i in range(int(round((TEMP_MAX - TEMP_MIN) / TEMP_STEP)) + 1)]
+
+
+def _temperature_params(temperature: float):
+    """温度 → (播放速率, 半音偏移)，整块与流式处理共用同一套映射"""
+    real_rate = 1.0 + (temperature - 1.0) * 0.25
+    real_pitch = (temperature - 1.0) * 1.5
+    return real_rate, real_pitch
+
+
+def _tone_params(temperature: float):
+    """
+    温度 → 音色阶段参数 (低通截止频率, 音量系数, 饱和驱动力)。
+    不需要的环节返回 None：降温只滤波+降音量，升温只做饱和失真。
+    """
+    if temperature < 1.0:
+        # 温度 0.5 时，截止频率暴降至 1200Hz；温度 0.9 时，恢复到 6000Hz 左右
+        return 1200 + (temperature - 0.5) * 9600, 0.8 + (temperature - 0.5) * 0.4, None
+    if temperature > 1.0:
+        # 温度越高，Drive 越大 (最高可达 5.0)
+        return None, 1.0, 1.0 + (temperature - 1.0) * 4.0
+    return None, 1.0, None
+
+
+# 质量档位：preview 在降采样副本上用更短的 STFT 处理，拖动滑块时保持跟手；final 保持原始采样率
+QUALITY_TIERS = {
+    "preview": {"sr": 16000, "n_fft": 1024},
+    "final": {"sr": None, "n_fft": 2048},
+}
+
+def tier_params(sr: int, tier: str) -> tuple:
+    """某个质量档位下实际使用的 (采样率, n_fft)；原始采样率本来就不高于档位上限时不降采样"""
+    params = QUALITY_TIERS[tier]
+    tier_sr = sr if params["sr"] is None or sr <= params["sr"] else params["sr"]
+    return tier_sr, params["n_fft"]
+
+def resample_for_tier(audio_series: np.ndarray, sr: int, tier: str) -> tuple:
+    """
+    把原始音频转换成某个质量档位的输入。
+    
+    Returns:
+        (y, sr): 无需降采样时原样返回输入本身 (不拷贝)
+    """
+    tier_sr, _ = tier_params(sr, tier)
+    if tier_sr == sr:
+        return audio_series, sr
+    import librosa
+    y = librosa.resample(np.asarray(audio_series, dtype=np.float32), orig_sr=sr, target_sr=tier_sr, res_type="soxr_hq")
+    return y, tier_sr
 
 # 新增：统一处理速度+音高的函数
-def process_audio_speed_and_pitch(audio_series: np.ndarray, temperature: float, sr: int = 22050) -> np.ndarray:
+@metrics.timed("process_audio")
+def process_audio_speed_and_pitch(audio_series: np.ndarray, temperature: float, sr: int = 22050,
+                                  n_fft: int = 2048) -> np.ndarray:
     """
     统一音频处理总控函数：根据温度综合调整速度、音高与频域特征。
     注意：这里新增了 sr (采样率) 参数，因为滤波需要知道采样率。
+    n_fft 决定变速变调的 STFT 窗长，各质量档位 (QUALITY_TIERS) 共用这一个入口。
     """
+    # 数据类型约定见 _working_dtype：float32 输入不会产生任何类型转换的拷贝
+    audio_series = np.asarray(audio_series)
+    audio_series = audio_series.astype(_working_dtype(audio_series), copy=False)
     current_audio = audio_series
 
-    real_rate = 1.0 + (temperature - 1.0) * 0.25 
-    real_pitch = (temperature - 1.0) * 1.5
+    real_rate, real_pitch = _temperature_params(temperature)
     
     try:
-        if real_rate != 1.0:
-            current_audio = librosa.effects.time_stretch(y=current_audio, rate=real_rate)
-        if real_pitch != 0.0:
-            current_audio = librosa.effects.pitch_shift(y=current_audio, sr=sr, n_steps=real_pitch)
+        # 变速与变调合并为一次 STFT 分析/合成，避免两轮相位声码器
+        if real_rate != 1.0 or real_pitch != 0.0:
+            current_audio = stretch_and_shift(current_audio, sr, real_rate, real_pitch, n_fft=n_fft)
     except Exception as e:
         print(f"DSP引擎处理异常: {e}")
         return audio_series
     
+    target_cutoff, gain, drive_amount = _tone_params(temperature)
     if temperature < 1.0:
         # 【暴力降温】：针对 Violent 音频
-        # 温度 0.5 时，截止频率暴降至 1200Hz，强行抹除怒吼的共振峰
-        # 温度 0.9 时，截止频率恢复到 6000Hz 左右
-        target_cutoff = 1200 + (temperature - 0.5) * (9600)
+        # 低通滤波强行抹除怒吼的共振峰
         current_audio = apply_lowpass_filter(current_audio, sr, target_cutoff)
         
-        # 稍微降低整体音量，配合柔软的听感
-        current_audio = current_audio * (0.8 + (temperature - 0.5) * 0.4)
+        # 稍微降低整体音量，配合柔软的听感 (滤波结果是新数组，直接原地缩放)
+        current_audio *= gain
 
     elif temperature > 1.0:
         # 【烈火淬炼】：针对 Soft 音频
-        # 计算过载驱动力 (Drive)：温度越高，Drive 越大 (最高可达 3.0)
-        drive_amount = 1.0 + (temperature - 1.0) * 4.0
-        
+        # 过载驱动力 (Drive)：温度越高，Drive 越大
         # 施加饱和失真，无中生有地创造"愤怒的张力"，同时 tanh 天然防爆音
-        current_audio = apply_saturation(current_audio, drive_amount)
+        # 变速变调的输出归本函数所有，可以原地计算；否则输入可能是共享的只读缓存，必须另开数组
+        owned = current_audio is not audio_series
+        current_audio = apply_saturation(current_audio, drive_amount, out=current_audio if owned else None)
 
     return current_audio
-    
+
    
-# ==========================================
+def warm_up(sr: int = 16000, seconds: float = 0.5) -> dict:
+    """
+    在一小段合成信号上把处理路径完整跑一遍 (升温、降温、声谱图、编码)：
+    触发 librosa / scipy 的导入，以及 librosa 内部 numba 函数的编译或磁盘缓存加载，
+    服务重启后的第一位用户就不必为这些一次性开销买单。
+
+    Returns:
+        {步骤: 秒}
+    """
+    t = np.arange(int(sr * seconds)) / sr
+    y = (0.1 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+    _, n_fft = tier_params(sr, "preview")
+    steps = (
+        ("saturation_path", lambda: process_audio_speed_and_pitch(y, 1.5, sr, n_fft=n_fft)),
+        ("lowpass_path", lambda: process_audio_speed_and_pitch(y, 0.7, sr, n_fft=n_fft)),
+        ("spectrogram", lambda: SpectrogramPyramid(y, sr)),
+        ("encode", lambda: encode_playback(y, sr, "FLAC")),
+    )
+    timings = {}
+    for name, fn in steps:
+        start = time.perf_counter()
+        fn()
+        timings[name] = round(time.perf_counter() - start, 6)
+    return timings
+
+# =========================================
 # 【第二部分：绘图逻辑函数】 - 负责后端的“画图”动作
 # ==========================================
 
-def draw_waveform_plotly(y: np.ndarray, sr: int, title: str, color: str):
+# 播放格式：名称 -> (容器格式, 编码子类型, MIME 类型)
+PLAYBACK_FORMATS = {
+    "FLAC": ("FLAC", "PCM_16", "audio/flac"),
+    "OGG": ("OGG", "VORBIS", "audio/ogg"),
+    "WAV": ("WAV", "PCM_16", "audio/wav"),
+}
+
+@metrics.timed("encode_playback")
+def encode_playback(y: np.ndarray, sr: int, fmt: str = "FLAC", quality: float = 0.6,
+                    block_size: int = 1 << 16) -> tuple:
     """
-    使用 Plotly 绘制交互式波形图 (自带降采样防御机制)
+    把音频编码成交给浏览器播放的压缩数据。
+    
+    Args:
+        fmt: PLAYBACK_FORMATS 中的一种；FLAC 无损，OGG (Vorbis) 有损但体积最小
+        quality: 0~1。对 OGG 是音质 (越高越清晰、体积越大)；
+                 对 FLAC 只影响压缩力度 (越低压得越狠、编码越慢)，音质始终无损
+    
+    Returns:
+        (encoded_bytes, mime_type)
     """
-    # 1. 内存防御：计算降采样步长 (Stride)
-    max_points = 2000
-    total_points = len(y)
+    container, subtype, mime = PLAYBACK_FORMATS[fmt]
+    # libsndfile 的 compression_level 越大压得越狠，与"质量"方向相反
+    level = None if container == "WAV" else float(np.clip(1.0 - quality, 0.0, 1.0))
     
-    if total_points > max_points:
-        step = total_points // max_points
-        # 类似 C 语言的循环步长遍历，Python 的切片语法 y[start:stop:step]
-        y_downsampled = y[::step] 
-    else:
-        y_downsampled = y
+    # 分块写入并逐块限幅，避免为长录音一次性生成整段整型副本
+    buffer = io.BytesIO()
+    with sf.SoundFile(buffer, mode="w", samplerate=sr, channels=1, format=container,
+                      subtype=subtype, compression_level=level) as f:
+        for start in range(0, len(y), block_size):
+            block = np.asarray(y[start:start + block_size], dtype=np.float32)
+            f.write(np.clip(block, -1.0, 1.0))
+    return buffer.getvalue(), mime
+
+
+class WaveformPyramid:
+    """
+    波形的多分辨率最小/最大值包络金字塔。
+    
+    第 0 层把信号按 base_bucket 个采样点分桶，每桶只记录最小值与最大值；
+    之后每一层把相邻两桶合并 (取较小的最小值、较大的最大值)，直到桶数足够少。
+    与原先的等间隔抽点不同，任何一个尖峰都会落在某个桶的极值里，不会被跳过。
+    """
+
+    @metrics.timed("waveform_pyramid")
+    def __init__(self, y: np.ndarray, sr: int, base_bucket: int = 32, min_buckets: int = 256,
+                 block_buckets: int = 1 << 16):
+        self.sr = sr
+        self.duration = len(y) / sr
+        n_buckets = max(1, int(np.ceil(len(y) / base_bucket)))
+
+        # 1. 分块做向量化的 reshape + min/max，长录音 (内存映射) 也只占用一个分块的内存
+        mins = np.empty(n_buckets, dtype=np.float32)
+        maxs = np.empty(n_buckets, dtype=np.float32)
+        block = block_buckets * base_bucket
+        for start in range(0, len(y), block):
+            chunk = np.asarray(y[start:start + block], dtype=np.float32)
+            b0 = start // base_bucket
+            n_full = len(chunk) // base_bucket
+            if n_full:
+                frames = chunk[:n_full * base_bucket].reshape(n_full, base_bucket)
+                frames.min(axis=1, out=mins[b0:b0 + n_full])
+                frames.max(axis=1, out=maxs[b0:b0 + n_full])
+            if len(chunk) > n_full * base_bucket:
+                # 末尾不满一桶的零头单独成桶
+                tail = chunk[n_full * base_bucket:]
+                mins[b0 + n_full] = tail.min()
+                maxs[b0 + n_full] = tail.max()
+        if len(y) == 0:
+            mins[:] = 0.0
+            maxs[:] = 0.0
+
+        # 2. 逐层两两合并，奇数个桶时最后一桶单独保留
+        self.levels = [(mins, maxs)]
+        self.seconds_per_bucket = [base_bucket / sr]
+        while len(self.levels[-1][0]) > min_buckets:
+            lo, hi = self.levels[-1]
+            n_pairs = len(lo) // 2
+            coarse_lo = np.minimum(lo[0:2 * n_pairs:2], lo[1:2 * n_pairs:2])
+            coarse_hi = np.maximum(hi[0:2 * n_pairs:2], hi[1:2 * n_pairs:2])
+            if len(lo) % 2:
+                coarse_lo = np.append(coarse_lo, lo[-1])
+                coarse_hi = np.append(coarse_hi, hi[-1])
+            self.levels.append((coarse_lo, coarse_hi))
+            self.seconds_per_bucket.append(self.seconds_per_bucket[-1] * 2)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(lo.nbytes + hi.nbytes for lo, hi in self.levels)
+
+    def view(self, max_points: int = 2000, time_range=None) -> tuple:
+        """
+        取出适合点数预算的一段包络。
         
-    # 生成对应的时间轴
-    time_axis = np.linspace(0, total_points / sr, len(y_downsampled))
+        Args:
+            max_points: 图表最多绘制的点数 (每个桶画最小、最大两个点)
+            time_range: (起始秒, 结束秒)，缩放时只取可见区间
+        
+        Returns:
+            (mins, maxs, seconds_per_bucket, t0)
+        """
+        t0, t1 = time_range if time_range is not None else (0.0, self.duration)
+        span = max(t1 - t0, 1e-9)
+        max_buckets = max(1, max_points // 2)
+
+        # 选择可见区间桶数不超过预算的最精细一层；预算再大也不会比第 0 层更细
+        level_index = len(self.levels) - 1
+        for index, spb in enumerate(self.seconds_per_bucket):
+            if span / spb <= max_buckets:
+                level_index = index
+                break
+        lo, hi = self.levels[level_index]
+        spb = self.seconds_per_bucket[level_index]
+        b0 = min(int(t0 / spb), len(lo) - 1)
+        b1 = max(b0 + 1, int(np.ceil(t1 / spb)))
+        return lo[b0:b1], hi[b0:b1], spb, b0 * spb
+
+
+@metrics.timed("draw_waveform")
+def draw_waveform_plotly(pyramid: WaveformPyramid, title: str, color: str, max_points: int = 2000,
+                         time_range=None):
+    """
+    使用 Plotly 绘制交互式波形图：从包络金字塔里取出点数预算内的一层，
+    每个桶画一条从最小值到最大值的竖线，峰值不会因为降采样而丢失。
+    """
+    import plotly.graph_objects as go
+
+    # 1. 取出视口对应的包络，并交错成 min, max, min, max ... 的折线
+    mins, maxs, spb, t0 = pyramid.view(max_points, time_range)
+    n = len(mins)
+    centers = t0 + (np.arange(n) + 0.5) * spb
+    time_axis = np.repeat(centers, 2)
+    envelope = np.empty(2 * n, dtype=np.float32)
+    envelope[0::2] = mins
+    envelope[1::2] = maxs
     
     # 2. 构建面向前端的轻量化图表对象
     fig = go.Figure()
     fig.add_trace(go.Scatter(
         x=time_axis,
-        y=y_downsampled,
+        y=envelope,
         mode="lines",
         line=dict(color=color, width=1.5),
         name="Amplitude",
@@ -193,26 +499,161 @@ def draw_waveform_plotly(y: np.ndarray, sr: int, title: str, color: str):
     
     return fig
 
-def draw_spectrogram(y, sr, title):
-    """绘制声谱图,返回Matplotlib画布对象"""
-    plt.style.use('default')  # 重置绘图样式
-    fig, ax = plt.subplots(figsize=(10, 3))
+def _stft_magnitude_pooled(y: np.ndarray, n_fft: int = 2048, hop_length: int = 512,
+                           max_frames: int = 2000, block_frames: int = 1024) -> tuple:
+    """
+    分块计算 STFT 幅度谱，并在时间轴上做最大值池化，最多保留 max_frames 列。
     
-    stft_result = librosa.stft(y)  #将音频从（幅度随时间变化）转换为（频率随时间变化）
+    整段做 librosa.stft 时，一小时的录音光复数频谱就要数百 MB；这里每次只对
+    block_frames 帧做 FFT，立刻取幅度并池化，峰值内存只取决于块大小。
+    帧的切分方式与 librosa.stft(center=True) 完全一致，短音频 (帧数不超过 max_frames) 的结果与整段计算相同。
     
-    db_data = librosa.amplitude_to_db(np.abs(stft_result), ref=np.max)
+    Returns:
+        (magnitude, pool): 池化后的幅度谱 (频点, 列数) 与每列合并的帧数
+    """
+    import librosa
+    n_frames = 1 + len(y) // hop_length
+    pool = int(np.ceil(n_frames / max_frames))
+    # 每块包含整数个池化组，保证池化边界不会跨块
+    block_frames = max(pool, block_frames // pool * pool)
+    columns = []
+
+    for f0 in range(0, n_frames, block_frames):
+        f1 = min(f0 + block_frames, n_frames)
+        # 该块在"补零后信号"中覆盖 [f0*hop, (f1-1)*hop + n_fft)，换算回原信号坐标
+        start = f0 * hop_length - n_fft // 2
+        stop = (f1 - 1) * hop_length + n_fft - n_fft // 2
+        segment = np.asarray(y[max(start, 0):max(min(stop, len(y)), 0)], dtype=np.float32)
+        segment = np.pad(segment, (max(0, -start), max(0, stop - max(start, len(y)))))
+        magnitude = np.abs(librosa.stft(segment, n_fft=n_fft, hop_length=hop_length, center=False))
+
+        # 时间轴最大值池化 (最后一组可能不满)
+        n_cols = magnitude.shape[1]
+        n_groups = int(np.ceil(n_cols / pool))
+        padded = np.pad(magnitude, [(0, 0), (0, n_groups * pool - n_cols)])
+        columns.append(padded.reshape(magnitude.shape[0], n_groups, pool).max(axis=2))
+
+    return np.concatenate(columns, axis=1), pool
+
+class SpectrogramPyramid:
+    """
+    声谱图的多分辨率金字塔 (Mipmap)。
     
-    img = librosa.display.specshow(    # 绘制声谱图
-        db_data,   
-        sr=sr,
-        x_axis='time',
-        y_axis='hz',
-        ax=ax,  #在ax子图上绘制
-        cmap='viridis' #配色
+    第 0 层是分块 STFT 得到的分贝谱，之后每一层在时间轴上做 2 倍最大值池化，
+    直到列数足够少。分贝值量化为 uint8 (0 ~ -top_db dB 映射到 255 ~ 0)，
+    一小时的录音整座金字塔也只有几 MB，适合按内容指纹长期缓存。
+    渲染时只取"刚好够视口用"的那一层，原始信号不需要再碰一次。
+    """
+
+    @metrics.timed("spectrogram_pyramid")
+    def __init__(self, y: np.ndarray, sr: int, n_fft: int = 2048, hop_length: int = 512,
+                 max_frames: int = 2048, top_db: float = 80.0):
+        self.sr = sr
+        self.n_fft = n_fft
+        self.top_db = top_db
+        self.duration = len(y) / sr
+
+        magnitude, pool = _stft_magnitude_pooled(y, n_fft=n_fft, hop_length=hop_length, max_frames=max_frames)
+        # 与 librosa.amplitude_to_db(ref=np.max) 相同：最大幅值为 0 dB，最低截断在 -top_db
+        import librosa
+        db_data = librosa.amplitude_to_db(magnitude, ref=np.max, top_db=top_db)
+        base = np.round((db_data + top_db) * (255.0 / top_db)).astype(np.uint8)
+
+        self.levels = [base]
+        self.seconds_per_col = [hop_length * pool / sr]
+        while self.levels[-1].shape[1] > 64:
+            level = self.levels[-1]
+            n_cols = level.shape[1] // 2 * 2
+            coarser = np.maximum(level[:, 0:n_cols:2], level[:, 1:n_cols:2])
+            self.levels.append(coarser)
+            self.seconds_per_col.append(self.seconds_per_col[-1] * 2)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(level.nbytes for level in self.levels)
+
+    def view(self, max_width: int = 1000, max_height: int = 256, time_range=None) -> tuple:
+        """
+        取出适合视口的一块图像。
+        
+        Args:
+            max_width / max_height: 视口能显示的最大列数 / 行数
+            time_range: (起始秒, 结束秒)，缩放时只取可见区间
+        
+        Returns:
+            (image, seconds_per_col, hz_per_row, t0): uint8 图像 (频率, 时间)，低频在第 0 行
+        """
+        t0, t1 = time_range if time_range is not None else (0.0, self.duration)
+        span = max(t1 - t0, 1e-9)
+
+        # 1. 选择可见区间列数不超过视口宽度的最精细一层
+        level_index = len(self.levels) - 1
+        for index, spc in enumerate(self.seconds_per_col):
+            if span / spc <= max_width:
+                level_index = index
+                break
+        level = self.levels[level_index]
+        spc = self.seconds_per_col[level_index]
+        c0 = int(t0 / spc)
+        c1 = max(c0 + 1, int(np.ceil(t1 / spc)))
+        image = level[:, c0:c1]
+
+        # 2. 频率轴同样做最大值池化，行数压到视口高度以内
+        row_pool = int(np.ceil(image.shape[0] / max_height))
+        n_rows = image.shape[0] // row_pool * row_pool
+        if row_pool > 1:
+            image = image[:n_rows].reshape(n_rows // row_pool, row_pool, -1).max(axis=1)
+        hz_per_row = self.sr / self.n_fft * row_pool
+        return image, spc, hz_per_row, c0 * spc
+
+
+@functools.lru_cache(maxsize=None)
+def _viridis_lut() -> np.ndarray:
+    """由 Plotly 自带的 Viridis 色阶插值得到 256 级 RGB 查找表"""
+    import plotly.colors
+    anchors = np.array([plotly.colors.hex_to_rgb(c) for c in plotly.colors.sequential.Viridis], dtype=np.float64)
+    positions = np.linspace(0, 1, len(anchors))
+    grid = np.linspace(0, 1, 256)
+    return np.stack([np.interp(grid, positions, anchors[:, ch]) for ch in range(3)], axis=1).astype(np.uint8)
+
+
+def _png_data_uri(rgb: np.ndarray) -> str:
+    """把 RGB 数组编码成 PNG 的 data URI，前端只需要下载一张小图"""
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.fromarray(rgb).save(buffer, format="PNG", optimize=False)
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+@metrics.timed("draw_spectrogram")
+def draw_spectrogram(pyramid: SpectrogramPyramid, title: str, max_width: int = 1000, max_height: int = 256,
+                     time_range=None):
+    """
+    绘制声谱图：从金字塔里取出视口大小的一层，上色后以 PNG 图片的形式交给 Plotly。
+    不再创建 Matplotlib 画布，也不会把完整的分贝矩阵序列化发给浏览器。
+    """
+    import plotly.graph_objects as go
+
+    image, spc, hz_per_row, t0 = pyramid.view(max_width, max_height, time_range)
+    rgb = _viridis_lut()[image]
+
+    fig = go.Figure(go.Image(
+        source=_png_data_uri(rgb),
+        x0=t0, dx=spc,
+        y0=0, dy=hz_per_row,
+        hoverinfo="none",
+    ))
+    fig.update_layout(
+        title=dict(text=f"{title} (0 ~ -{pyramid.top_db:.0f} dB)", font=dict(size=14)),
+        xaxis_title="Time (s)",
+        yaxis_title="Hz",
+        height=260,
+        margin=dict(l=10, r=10, t=40, b=10),
+        plot_bgcolor="rgba(0,0,0,0)",
+        paper_bgcolor="rgba(0,0,0,0)",
     )
-    ax.set_title(title, fontsize=12, pad=10)
-    fig.colorbar(img, ax=ax, format="%+2.f dB", shrink=0.8) #添加颜色条，解释声谱图中颜色与分贝值的对应关系
-    plt.tight_layout()
+    # go.Image 默认把 y 轴倒置；改回常规朝向后，Plotly 会把第 0 行 (低频) 画在最下方
+    fig.update_yaxes(autorange=True)
     return fig
 
 # 首先，np.abs(stft_result) 计算短时傅里叶变换（STFT）结果的幅值谱，因为 STFT 结果是复数矩阵，幅值反映了每个时间和频率点上的能量强度。然后，librosa.amplitude_to_db 函数将这些幅值数据转换为分贝刻度。分贝是一种对数单位，更符合人耳对声音强度的感知。
@@ -0,0 +1,376 @@
+# vault.py
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import soundfile as sf
+
+import cache
+import pack
+
+# 清单文件放在金库目录里，以点号开头，扫描音频时会被跳过
+MANIFEST_NAME = ".vault_manifest.json"
+# 按内容指纹存放的去重音频块
+BLOB_DIR_NAME = "blobs"
+# 可选的打包存储：无损转码成 FLAC 后追加进同一个打包文件
+PACK_DIR_NAME = "packs"
+
+# 可以无损转成 FLAC 的整数 PCM 子类型 → FLAC 子类型 (浮点 PCM 与 mp3/ogg 等有损格式保持原样)
+FLAC_SUBTYPES = {"PCM_S8": "PCM_S8", "PCM_U8": "PCM_S8", "PCM_16": "PCM_16", "PCM_24": "PCM_24"}
+# 转码与校验时每次处理的帧数
+TRANSCODE_BLOCK_FRAMES = 1 << 16
+# 打包文件中的垃圾超过这个比例时顺手整理
+PACK_COMPACT_RATIO = 0.5
+
+
+def _probe_audio(file_path):
+    """只读取文件头，拿到时长与采样率；解不开的格式 (如部分 mp3) 记为 None"""
+    try:
+        info = sf.info(file_path)
+        return round(info.duration, 3), info.samplerate
+    except Exception:
+        return None, None
+
+
+def _encode_flac_lossless(blob_path: str):
+    """
+    把整数 PCM 音频 (wav/aiff 等) 分块转码为 FLAC，并逐块解码回来校验逐采样一致。
+    不适合转码 (已是 FLAC、浮点 PCM、有损格式) 或转码后反而没有变小时返回 None。
+    """
+    try:
+        info = sf.info(blob_path)
+    except Exception:
+        return None
+    if info.format == "FLAC" or info.subtype not in FLAC_SUBTYPES:
+        return None
+
+    buffer = io.BytesIO()
+    with sf.SoundFile(blob_path) as src, \
+            sf.SoundFile(buffer, "w", src.samplerate, src.channels, FLAC_SUBTYPES[info.subtype], format="FLAC") as dst:
+        for block in src.blocks(TRANSCODE_BLOCK_FRAMES, dtype="int32", always_2d=True):
+            dst.write(block)
+    data = buffer.getvalue()
+    if len(data) >= os.path.getsize(blob_path):
+        return None
+
+    with sf.SoundFile(blob_path) as src, sf.SoundFile(io.BytesIO(data)) as check:
+        if check.frames != src.frames:
+            return None
+        for original in src.blocks(TRANSCODE_BLOCK_FRAMES, dtype="int32", always_2d=True):
+            if not np.array_equal(original, check.read(len(original), dtype="int32", always_2d=True)):
+                return None
+    return data
+
+
+def read_blob_bytes(vault_dir: str, audio_hash: str) -> bytes:
+    """
+    不经过 VaultStore 直接读取一段音频的字节 (离线工具在别的进程里使用，不修改金库)：
+    原始文件还在就读原始文件，否则从打包文件里读。
+    """
+    blob_path = os.path.join(vault_dir, BLOB_DIR_NAME, audio_hash)
+    if os.path.exists(blob_path):
+        with open(blob_path, "rb") as f:
+            return f.read()
+    return pack.PackFile(os.path.join(vault_dir, PACK_DIR_NAME)).read(audio_hash)
+
+
+class VaultStore:
+    """
+    全进程共享、按内容寻址的金库。
+
+    磁盘布局：
+        local_ice_vault/blobs/<指纹>      真正的音频内容，相同内容只存一份
+        local_ice_vault/packs/            (可选) 转码成 FLAC 之后的音频块，见 pack.PackFile
+        local_ice_vault/.vault_manifest.json
+            names: {文件名: {hash, added}}                          用户可见的名字 → 指纹
+            blobs: {指纹: {size, duration, sr, refs, packed?, pack_skipped?}}      引用计数为 0 时才删除音频块
+
+    所有会话共用同一个实例 (由 main.py 的 @st.cache_resource 托管)，
+    读到内存里的音频块也放在一个共享的 LRU 缓存里，内存只随"不同的音频"增长，与会话数无关。
+
+    use_pack=True 时，新入库的整数 PCM 音频 (例如浏览器录音的 WAV) 由后台线程无损转码为 FLAC、
+    追加进打包文件，校验通过后删除原始文件。指纹仍是原始字节的指纹；读取时拿到的是 FLAC 字节，
+    解码出的采样与原始文件完全相同。
+    """
+
+    def __init__(self, vault_dir: str, blob_cache_bytes: int = 256 * 1024 * 1024, use_pack: bool = False):
+        self.vault_dir = vault_dir
+        self.blob_dir = os.path.join(vault_dir, BLOB_DIR_NAME)
+        self.manifest_path = os.path.join(vault_dir, MANIFEST_NAME)
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+        self.names_map = {}
+        self.blobs = {}
+        self._blob_cache = cache.LRUByteCache(max_bytes=blob_cache_bytes)
+        self._lock = threading.RLock()
+
+        # 打包文件始终可读 (之前打开过打包存储的金库)，use_pack 只决定是否继续转码新条目
+        self._pack = pack.PackFile(os.path.join(vault_dir, PACK_DIR_NAME))
+        self._transcoder = None
+        if use_pack:
+            self._transcoder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="voiceice-transcode")
+
+        with self._lock:
+            self._load_manifest()
+            self._ingest_loose_files()
+            # 之前还没来得及转码的条目 (例如上次运行时中途退出) 重新排队；
+            # 已经确认无法打包的条目 (mp3、浮点 PCM、FLAC 压不小的 PCM) 不再重复探测
+            for audio_hash, record in self.blobs.items():
+                if not record.get("packed") and not record.get("pack_skipped"):
+                    self._schedule_transcode(audio_hash)
+
+    # ------------------------------------------------------------
+    # 清单读写
+    # ------------------------------------------------------------
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            # 清单缺失或损坏时从零重建，不影响金库里的音频本身
+            manifest = {}
+
+        self.names_map = manifest.get("names", {})
+        self.blobs = {
+            audio_hash: record for audio_hash, record in manifest.get("blobs", {}).items()
+            if (audio_hash in self._pack if record.get("packed") else os.path.exists(self._blob_path(audio_hash)))
+        }
+        # 丢弃指向已不存在音频块的名字，并按名字表重新核对引用计数
+        self.names_map = {n: e for n, e in self.names_map.items() if e["hash"] in self.blobs}
+        for record in self.blobs.values():
+            record["refs"] = 0
+        for entry in self.names_map.values():
+            self.blobs[entry["hash"]]["refs"] += 1
+
+    def _save_manifest(self):
+        manifest = {"names": self.names_map, "blobs": self.blobs}
+        cache.atomic_write(self.manifest_path, json.dumps(manifest, ensure_ascii=False, indent=1).encode("utf-8"))
+
+    def _ingest_loose_files(self):
+        """把旧版本直接散落在金库根目录里的音频文件迁移进内容寻址存储"""
+        loose = [
+            e for e in os.scandir(self.vault_dir)
+            if e.is_file() and not e.name.startswith(".")
+        ]
+        for dir_entry in sorted(loose, key=lambda e: e.stat().st_mtime):
+            added = dir_entry.stat().st_mtime
+            audio_hash = cache.file_content_hash(dir_entry.path)
+            blob_path = self._blob_path(audio_hash)
+            if audio_hash in self.blobs:
+                # 内容重复的文件只保留一份音频块
+                os.remove(dir_entry.path)
+            else:
+                os.replace(dir_entry.path, blob_path)
+                self._register_blob(audio_hash, blob_path)
+                self._schedule_transcode(audio_hash)
+            self._link(dir_entry.name, audio_hash, added)
+        if loose:
+            self._save_manifest()
+
+    # ------------------------------------------------------------
+    # 内部工具
+    # ------------------------------------------------------------
+    def _blob_path(self, audio_hash: str) -> str:
+        return os.path.join(self.blob_dir, audio_hash)
+
+    def _register_blob(self, audio_hash: str, blob_path: str):
+        duration, sr = _probe_audio(blob_path)
+        self.blobs[audio_hash] = {
+            "size": os.path.getsize(blob_path),
+            "duration": duration,
+            "sr": sr,
+            "refs": 0,
+        }
+
+    def _link(self, name: str, audio_hash: str, added: float):
+        """
+        让名字指向某个音频块；若该名字原本指向别的内容，先释放旧引用。
+        旧音频块因此被真正删除时返回它的指纹，否则返回 None。
+        """
+        old = self.names_map.get(name)
+        freed = None
+        if old is not None:
+            if old["hash"] == audio_hash:
+                return None
+            if self._unref(old["hash"]):
+                freed = old["hash"]
+        self.names_map[name] = {"hash": audio_hash, "added": added}
+        self.blobs[audio_hash]["refs"] += 1
+        return freed
+
+    def _unref(self, audio_hash: str) -> bool:
+        """释放一个引用；音频块因此被真正删除时返回 True"""
+        record = self.blobs[audio_hash]
+        record["refs"] -= 1
+        # 没有任何名字再引用这段音频时，才真正从磁盘和内存里删除
+        if record["refs"] <= 0:
+            del self.blobs[audio_hash]
+            self._blob_cache.discard(audio_hash)
+            blob_path = self._blob_path(audio_hash)
+            if os.path.exists(blob_path):
+                os.remove(blob_path)  # 调用系统接口删除文件
+            if record.get("packed"):
+                # 打包文件只追加，这里只从索引除名，空间留给后台整理时回收
+                self._pack.remove(audio_hash)
+                if self._transcoder is not None:
+                    self._transcoder.submit(self._compact_pack)
+            return True
+        return False
+
+    # ------------------------------------------------------------
+    # 后台转码 (use_pack=True)
+    # ------------------------------------------------------------
+    def _schedule_transcode(self, audio_hash: str):
+        if self._transcoder is not None:
+            self._transcoder.submit(self._transcode, audio_hash)
+
+    def _transcode(self, audio_hash: str):
+        """在转码线程里执行：转码、追加进打包文件，确认条目仍然存在后再删除原始文件"""
+        with self._lock:
+            record = self.blobs.get(audio_hash)
+            if record is None or record.get("packed") or record.get("pack_skipped"):
+                return
+            blob_path = self._blob_path(audio_hash)
+        try:
+            data = _encode_flac_lossless(blob_path)
+        except Exception as e:
+            # 转码只是为了省空间，失败时原始文件照常使用
+            print(f"金库转码异常 ({audio_hash}): {e!r}")
+            return
+        if data is None:
+            # 不适合无损打包：记进清单，之后重启时不再重新探测、重新编码
+            with self._lock:
+                record = self.blobs.get(audio_hash)
+                if record is not None:
+                    record["pack_skipped"] = True
+                    self._save_manifest()
+            return
+        self._pack.append(audio_hash, data)
+
+        with self._lock:
+            record = self.blobs.get(audio_hash)
+            if record is None:
+                # 转码期间条目被删除了
+                self._pack.remove(audio_hash)
+                return
+            record["packed"] = True
+            record["stored_size"] = len(data)
+            self._save_manifest()
+            if os.path.exists(blob_path):
+                os.remove(blob_path)
+
+    def _compact_pack(self):
+        """打包文件里被删除条目占用的空间过半时整理一次"""
+        with self._lock:
+            live = sum(r.get("stored_size", 0) for r in self.blobs.values() if r.get("packed"))
+        garbage = self._pack.garbage_bytes
+        if garbage > PACK_COMPACT_RATIO * (garbage + live):
+            self._pack.compact()
+
+    def flush_transcodes(self):
+        """等待已排队的转码全部完成 (离线工具与测试脚本用)"""
+        if self._transcoder is not None:
+            self._transcoder.submit(lambda: None).result()
+
+    # ------------------------------------------------------------
+    # 对外接口
+    # ------------------------------------------------------------
+    def sync(self):
+        """重新扫描金库根目录，收编运行期间被直接拷进来的音频文件"""
+        with self._lock:
+            self._ingest_loose_files()
+
+    def names(self) -> list:
+        """按登记时间排序的文件名列表 (最早的在前)"""
+        with self._lock:
+            return sorted(self.names_map, key=lambda n: self.names_map[n]["added"])
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self.names_map
+
+    def get(self, name) -> dict:
+        """返回 {name, hash, added, size, duration, sr}，名字不存在时返回 None"""
+        with self._lock:
+            entry = self.names_map.get(name)
+            if entry is None:
+                return None
+            record = self.blobs[entry["hash"]]
+            return {"name": name, **entry, "size": record["size"],
+                    "duration": record["duration"], "sr": record["sr"]}
+
+    def _open_blob(self, audio_hash: str):
+        """以只读文件对象打开一段音频 (原始文件或打包文件里的一条记录)"""
+        with self._lock:
+            packed = self.blobs[audio_hash].get("packed")
+            if not packed:
+                # 在锁内打开：转码线程删除原始文件之后，已经打开的句柄仍然可读
+                return open(self._blob_path(audio_hash), "rb")
+        return self._pack.open(audio_hash)
+
+    def read_bytes(self, name: str) -> bytes:
+        """
+        按需读取某个条目的二进制数据，同一段音频在所有会话之间只保留一份。
+        已打包的条目返回 FLAC 字节，解码结果与原始文件一致。
+        """
+        audio_hash = self.names_map[name]["hash"]
+
+        def _read():
+            with self._open_blob(audio_hash) as f:
+                return f.read()
+
+        return self._blob_cache.get_or_compute(audio_hash, _read)
+
+    def read_frames(self, name: str, start: int = 0, frames: int = -1) -> tuple:
+        """
+        只解码某个条目中从第 start 帧开始的 frames 帧 (-1 表示到结尾)，单声道 float32。
+        FLAC / WAV 支持直接跳转，局部读取不必解压整段录音；
+        soundfile 打不开的格式 (例如部分 mp3) 退回整段解码再截取。
+
+        Returns:
+            (y, sr)
+        """
+        audio_hash = self.names_map[name]["hash"]
+        try:
+            with self._open_blob(audio_hash) as f, sf.SoundFile(f) as audio:
+                audio.seek(start)
+                y = audio.read(frames, dtype="float32", always_2d=True)
+                return np.ascontiguousarray(y.mean(axis=1, dtype=np.float32)), audio.samplerate
+        except sf.SoundFileError:
+            import utils
+            y, sr = utils.decode_audio_bytes(self.read_bytes(name))
+            return y[start:] if frames < 0 else y[start:start + frames], sr
+
+    def add(self, name: str, raw_bytes: bytes):
+        """
+        存入一段音频：内容已存在时只增加一个名字引用，不会重复落盘。
+        同名文件会改为指向新的内容；旧内容因此不再被任何名字引用、被真正删除时，
+        返回它的指纹 (与 remove 相同，方便调用方清理派生缓存)，否则返回 None。
+        """
+        audio_hash = cache.content_hash(raw_bytes)
+        with self._lock:
+            if audio_hash not in self.blobs:
+                blob_path = self._blob_path(audio_hash)
+                cache.atomic_write(blob_path, raw_bytes)
+                self._register_blob(audio_hash, blob_path)
+                self._schedule_transcode(audio_hash)
+            freed = self._link(name, audio_hash, time.time())
+            self._save_manifest()
+            return freed
+
+    def remove(self, name: str):
+        """
+        删除一个名字；只有当音频块不再被任何名字引用时才删除磁盘上的内容。
+        音频块被真正删除时返回它的指纹 (方便调用方清理派生缓存)，否则返回 None。
+        """
+        with self._lock:
+            entry = self.names_map.pop(name, None)
+            if entry is None:
+                return None
+            deleted = self._unref(entry["hash"])
+            self._save_manifest()
+            return entry["hash"] if deleted else None
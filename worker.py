@@ -0,0 +1,194 @@
+# worker.py
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+# ==========================================
+# 【后台渲染】 - 把 DSP 处理移出 Streamlit 脚本线程
+# 每个会话一个 RenderSlot：同一时刻最多一个任务在执行，外加一个"最新请求"在排队。
+# 拖动滑块时新的请求不断顶替排队中的旧请求，已经过时的温度根本不会开始计算；
+# 正在执行的任务会收到取消信号，在下一个检查点退出 (见 RenderCancelled)。
+# 界面在新结果出来之前继续显示最近一次完成的结果。
+# NumPy / SciPy / soxr 的重计算会释放 GIL，用线程池即可并行，也不必在进程之间拷贝整段音频。
+# ==========================================
+
+
+class RenderCancelled(Exception):
+    """任务在检查点发现自己已被更新的请求顶替，主动放弃；线程池把它当作顶替处理，而不是失败"""
+
+
+def check_cancelled(cancel):
+    """长任务在检查点调用：cancel (threading.Event，可以为 None) 已置位时抛出 RenderCancelled"""
+    if cancel is not None and cancel.is_set():
+        raise RenderCancelled()
+
+
+class RenderSlot:
+    """
+    一个会话的渲染槽 (存放在 st.session_state 里)。
+
+    running_key: 正在执行的任务键
+    done_key / done_value: 最近一次完成的任务键与结果，新结果出来之前界面显示它
+    error: 最近一次失败的 (任务键, 异常)
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._future = None
+        self._queued = None   # (key, fn)：正在执行的任务结束后再开始
+        self._cancel = None   # 正在执行的任务的取消信号
+        self.running_key = None
+        self.done_key = None
+        self.done_value = None
+        self.error = None
+
+    @property
+    def busy(self) -> bool:
+        with self._lock:
+            return self._future is not None or self._queued is not None
+
+    def show(self, key, value):
+        """结果已在共享缓存里时直接登记为最近完成，并丢弃排队中的过时请求"""
+        with self._lock:
+            self._queued = None
+            self.done_key, self.done_value = key, value
+
+    def latest(self) -> tuple:
+        """(最近完成的任务键, 结果)，在锁内一起读出，保证两者对应"""
+        with self._lock:
+            return self.done_key, self.done_value
+
+    def wait(self, key, timeout: float = None) -> bool:
+        """
+        等待 key 对应的任务完成 (timeout 为 None 时一直等)；返回是否已完成。
+        key 还在排队时先等前面正在执行的任务结束；任务失败或被顶替时返回 False。
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if self.done_key == key:
+                    return True
+                if self.running_key != key and (self._queued is None or self._queued[0] != key):
+                    return False
+                future = self._future
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            try:
+                future.result(timeout=remaining)
+            except Exception:
+                # 超时、取消或任务本身出错都回到循环开头重新判断
+                pass
+
+
+class RenderWorkerPool:
+    """全进程共享的渲染线程池 (由 main.py 的 @st.cache_resource 托管)"""
+
+    def __init__(self, max_workers: int = None, name: str = "render"):
+        if max_workers is None:
+            max_workers = min(4, os.cpu_count() or 1)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"voiceice-{name}")
+        self._lock = threading.Lock()
+        # 统计：被新请求顶替的任务数 (从未开始执行，或执行中途收到取消信号退出)
+        self.superseded = 0
+
+    def request(self, slot: RenderSlot, key, fn):
+        """
+        为某个会话请求一次渲染。fn(cancel) 在线程池里执行，返回值记为该键的结果；
+        cancel 是 threading.Event，任务被顶替时置位，fn 应在检查点调用 check_cancelled(cancel)。
+        - 与正在执行 (且未被取消) 或刚完成的任务相同：什么也不做
+        - 没有任务在执行：立即提交
+        - 已提交但还没轮到执行 (线程池被其它会话占满)：取消它，换成新请求
+        - 正在执行：通知它在下一个检查点退出，新请求排队，并顶替更早排队的请求
+        """
+        with slot._lock:
+            if key == slot.done_key or (key == slot.running_key and not slot._cancel.is_set()):
+                # 用户又拖回了正在计算或刚算完的温度，排队中的请求随之作废
+                self._drop_queued(slot)
+                return
+
+            if slot._future is not None:
+                future = slot._future
+                # 先解除关联，取消时触发的回调就会把它当作过期任务忽略
+                slot._future = None
+                if future.cancel():
+                    self._count_superseded()
+                    self._start(slot, key, fn)
+                else:
+                    slot._future = future
+                    self._drop_queued(slot)
+                    slot._queued = (key, fn)
+                    slot._cancel.set()
+                return
+            self._start(slot, key, fn)
+
+    def _drop_queued(self, slot: RenderSlot):
+        if slot._queued is not None:
+            slot._queued = None
+            self._count_superseded()
+
+    def _count_superseded(self):
+        with self._lock:
+            self.superseded += 1
+
+    def _start(self, slot: RenderSlot, key, fn):
+        slot.running_key = key
+        slot._cancel = threading.Event()
+        future = self._executor.submit(fn, slot._cancel)
+        slot._future = future
+        future.add_done_callback(lambda f: self._finished(slot, key, f))
+
+    def _finished(self, slot: RenderSlot, key, future):
+        with slot._lock:
+            if slot._future is not future:
+                return
+            if not future.cancelled():
+                error = future.exception()
+                if error is None:
+                    slot.done_key, slot.done_value = key, future.result()
+                elif isinstance(error, RenderCancelled):
+                    self._count_superseded()
+                else:
+                    slot.error = (key, error)
+            slot._future = None
+            slot.running_key = None
+            slot._cancel = None
+            if slot._queued is not None:
+                next_key, next_fn = slot._queued
+                slot._queued = None
+                self._start(slot, next_key, next_fn)
+
+
+# ==========================================
+# 【离线任务】 - 批量渲染 (batch.py) 与特征补算 (features.py) 共用的进程池分发
+# ==========================================
+
+
+def run_process_jobs(fn, jobs, on_result, workers: int = None) -> int:
+    """
+    把一组互相独立的任务分发到进程池并行执行，逐个汇报进度。
+
+    fn: 模块级函数 (才能被进程池序列化后分发)，每个任务执行 fn(*参数)
+    jobs: [(大小, 名称, 参数元组)]
+    on_result(名称, 结果): 每完成一个任务在主进程里调用一次 (例如落盘)，返回要打印的进度说明
+
+    Returns:
+        失败的任务数 (0 表示全部成功)
+    """
+    # 大的先发，避免最后只剩一个长任务拖住整个进程池
+    jobs = sorted(jobs, key=lambda job: job[0], reverse=True)
+    failures = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fn, *args): name for _, name, args in jobs}
+        for done, future in enumerate(as_completed(futures), start=1):
+            name = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"[{done}/{len(jobs)}] 失败 {name}: {e!r}", file=sys.stderr)
+                continue
+            print(f"[{done}/{len(jobs)}] {on_result(name, result)}")
+    return failures